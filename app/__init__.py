@@ -2,18 +2,17 @@ import json
 import logging
 import os
 import sys
+import click
 from . import constants
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, current_app
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask_htmx import HTMX
 from datetime import datetime
-from distutils.version import LooseVersion
 
 from sqlalchemy import MetaData
 from config import settings
 from dynaconf import FlaskDynaconf
-from flask_login import LoginManager
+from flask_login import LoginManager, login_url
 from flask_bcrypt import Bcrypt
 
 ascii_logo = """
@@ -39,11 +38,10 @@ htmx = HTMX()
 dynaconf = FlaskDynaconf()
 login_manager = LoginManager()
 bcrypt = Bcrypt()
-migrate = Migrate()
 
 
 def sort_versions(versions):
-    return sorted(versions, key=lambda x: LooseVersion(x.version_code), reverse=True)
+    return sorted(versions, key=lambda x: x.version_sort_key or '', reverse=True)
 
 def page_not_found(e):
   return render_template('error/404.j2',error=True), 404
@@ -66,6 +64,13 @@ def remove_none_values(value):
         return value
 
 
+def dispose_engines(app, close=True):
+    """Empty the connection pools of ``app``, ``close=False`` leaves the connections to the process that opened them."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
 class PrefixLoggerAdapter(logging.LoggerAdapter):
     """ A logger adapter that adds a prefix to every message """
     def process(self, msg: str, kwargs: dict) -> (str, dict):
@@ -79,8 +84,11 @@ def create_app():
     app.register_error_handler(500, internal_server_error)
 
     db.init_app(app)
-    from app.models import User, Package, PackageVersion, Installer, InstallerSwitch, Permission, Role, Setting
-    migrate.init_app(app, db)
+    from app.models import User, Package, PackageVersion, Installer, InstallerSwitch, Permission, Role, Setting, ChangeStamp, HashJob, MultipartUpload, StorageDeletion, StorageOrphan, StorageScan
+    # Alembic is a large part of the import time and only the flask command needs it, for "flask db ..."
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
     htmx.init_app(app)
     dynaconf.init_app(app)
     bcrypt.init_app(app)
@@ -89,9 +97,31 @@ def create_app():
     login_manager.login_message = ''
     login_manager.init_app(app)
 
+    from app.principals import principals
+    principals.init_app(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return principals.load(int(user_id))
+
+    from app.tokens import bearer_token, load_token_principal, token_usage
+    token_usage.init_app(app)
+
+    @login_manager.request_loader
+    def load_user_from_request(request):
+        # API tokens authenticate the API blueprint only, without a session
+        token = bearer_token(request)
+        if token is None or request.blueprint != 'api':
+            return None
+        return load_token_principal(token)
+
+    @login_manager.unauthorized_handler
+    def unauthorized():
+        if bearer_token(request) is not None:
+            if request.blueprint != 'api':
+                return jsonify({"error": "API tokens are only accepted by /api"}), 401
+            return jsonify({"error": "Invalid or expired API token"}), 401
+        return redirect(login_url(login_manager.login_view, request.url))
 
     from app.ui_routes import ui
     from app.api_routes import api
@@ -103,6 +133,27 @@ def create_app():
     app.register_blueprint(winget, url_prefix='/wg')
     app.register_blueprint(auth)
 
+    from app.cache import download_routes, manifest_cache, package_counts, settings_snapshot
+    manifest_cache.init_app(app, 'MANIFEST_CACHE_SIZE')
+    download_routes.init_app(app, 'DOWNLOAD_ROUTE_CACHE_SIZE')
+    package_counts.init_app(app)
+    settings_snapshot.init_app(app)
+    from app.search import search_index
+    search_index.init_app(app)
+    from app.counters import download_counter
+    download_counter.init_app(app)
+    from app.storage import blob_store, multipart_uploads, presigned_urls, storage_deletions
+    presigned_urls.init_app(app)
+    blob_store.init_app(app)
+    storage_deletions.init_app(app)
+    multipart_uploads.init_app(app)
+    from app.jobs import hash_jobs
+    hash_jobs.init_app(app)
+    from app.passwords import password_hasher
+    password_hasher.init_app(app)
+    from app.uploads import UploadRequest
+    app.request_class = UploadRequest
+
     app.jinja_env.filters['sort_versions'] = sort_versions
     app.jinja_env.filters['remove_none_values'] = remove_none_values
 
@@ -130,12 +181,9 @@ def create_app():
     app.add_template_global(constants.installer_scopes, name='installer_scopes')
     app.add_template_global(constants.simplified_nested_installer_types, name='nested_installer_types')
 
-    def get_settings():
-        return {setting.key.upper(): setting.get_value() for setting in Setting.query.all()}
-    
     @app.context_processor
     def inject_settings():
-        return dict(global_settings=get_settings())
+        return dict(global_settings=settings_snapshot.all())
 
     @app.context_processor
     def inject_now():
@@ -149,10 +197,12 @@ def create_app():
     # Hacky way to not trigger permissions creation on flask db upgrade as db is not yet initialized
     if not 'flask' in sys.argv and not 'db' in sys.argv:
         with app.app_context():
-            from app.permissions import create_all
-            create_all()
-            from app.settings import create_all
-            create_all()
+            from app.seed import bootstrap
+            bootstrap()
+
+    # A forked worker (gunicorn preload_app) must not share the connections create_app opened with its parent
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: dispose_engines(app, close=False))
 
         
 
@@ -1,5 +1,5 @@
 import os
-import boto3
+from datetime import datetime, timedelta
 from flask import (
     Blueprint,
     Response,
@@ -10,18 +10,26 @@ from flask import (
     stream_with_context,
     url_for,
     current_app,
-    send_from_directory,
     flash,
 )
 from flask_login import current_user, login_required
+from sqlalchemy import select
 from werkzeug.http import parse_range_header
 from werkzeug.utils import secure_filename
-import requests
 from app import db
+from app.cache import manifest_cache, settings_snapshot
+from app.counters import download_counter
+from app.storage import blob_store, get_s3_client, multipart_uploads, presigned_urls
+from app.delivery import send_installer
 from app.decorators import permission_required
+from app.principals import principals
+from app.tokens import generate_token, token_digest
+from app.search import search_index
 from app.forms import AddInstallerForm, AddPackageForm, AddVersionForm
 from app.models import (
+    ApiToken,
     InstallerSwitch,
+    MultipartUpload,
     Package,
     PackageVersion,
     Installer,
@@ -29,12 +37,25 @@ from app.models import (
     Role,
     Setting,
     User,
+    split_list,
+)
+from app.utils import (
+    PACKAGE_LIST_FIELDS,
+    count_packages,
+    create_installer,
+    decode_cursor,
+    encode_cursor,
+    package_list_columns,
+    save_file,
+    basedir,
+    delete_installer_util,
+    delete_version_installers,
+    installers_for_deletion,
+    resolve_download,
 )
-from app.utils import create_installer, save_file, basedir, delete_installer_util
 from app.constants import installer_switches
 
 api = Blueprint("api", __name__)
-s3_client = boto3.client("s3")
 
 
 @api.route("/")
@@ -48,31 +69,43 @@ URL_EXPIRATION_SECONDS = 3600
 @login_required
 @permission_required("view:package")
 def packages():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('limit', 10, type=int)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
     search_query = request.args.get('search', '', type=str)
-
-    query = Package.query
-
-    if search_query:
-        search = "%{}%".format(search_query)
-        query = query.filter(
-            db.or_(
-                Package.name.ilike(search),
-                Package.identifier.ilike(search),
-                Package.publisher.ilike(search)
-            )
-        )
-
-    paginated_packages = query.paginate(page=page,per_page=per_page,error_out=False)
-    packages = paginated_packages.items
-
-    return jsonify({
-        'packages': [package.to_dict() for package in packages],
-        'total': paginated_packages.total,
-        'pages': paginated_packages.pages,
-        'current_page': paginated_packages.page
-    })
+    fields = [field.strip() for field in request.args.get('fields', '', type=str).split(',') if field.strip()]
+    fields = fields or list(PACKAGE_LIST_FIELDS)
+    unknown = set(fields) - set(PACKAGE_LIST_FIELDS)
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+
+    # The id is always selected, the next cursor is built from it
+    query = select(*package_list_columns(['id'] + [field for field in fields if field != 'id']))
+    condition = search_index.condition(search_query) if search_query else None
+    if condition is not None:
+        query = query.where(condition)
+
+    cursor = request.args.get('cursor', '', type=str)
+    page = request.args.get('page', type=int)
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.where(Package.id > after)
+    elif page:
+        # Kept for API clients paging by number, the cursor avoids scanning the skipped rows
+        query = query.offset((max(page, 1) - 1) * limit)
+
+    # One row more than requested tells whether there is a next page
+    rows = db.session.execute(query.order_by(Package.id).limit(limit + 1)).mappings().all()
+    response = {
+        'packages': [{field: row[field] for field in fields} for row in rows[:limit]],
+        'next_cursor': encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None,
+    }
+    if page and not cursor:
+        response['current_page'] = max(page, 1)
+    if request.args.get('total', 'false', type=str).lower() in ('1', 'true'):
+        response['total'] = count_packages(search_query, condition)
+        response['pages'] = -(-response['total'] // limit)
+    return jsonify(response)
 
 @api.get("/package/<identifier>")
 @login_required
@@ -147,37 +180,47 @@ def get_version_by_id(version_id):
     return jsonify(version.to_dict())
 
 
+def upload_object_key():
+    """S3 key and file name ('scope.file_extension') a browser upload described by the request form is stored at."""
+    # Extract file information from the request
+    file_extension = request.form.get("file_name").rsplit(".", 1)[1]
+
+    # Specify the S3 object key where the file will be uploaded
+    publisher = secure_filename(request.form.get("publisher"))
+    identifier = secure_filename(request.form.get("identifier"))
+    # Get version from db either by id or by name from the request
+    version = secure_filename(request.form.get("installer-version"))
+
+    architecture = secure_filename(request.form.get("installer-architecture"))
+    scope = secure_filename(request.form.get("installer-installer_scope"))
+    file_name = f"{scope}.{file_extension}"
+    return f"packages/{publisher}/{identifier}/{version}/{architecture}/{file_name}", file_name
+
+
 @api.route("/generate_presigned_url", methods=["POST"])
 @login_required
 @permission_required("add:installer")
 def generate_presigned_url():
     try:
-        # Extract file information from the request
         file_name = request.form.get("file_name")
-        file_extension = file_name.rsplit(".", 1)[1]
         content_type = request.form.get("content_type")
-
-        # Specify the S3 object key where the file will be uploaded
-        publisher = secure_filename(request.form.get("publisher"))
-        identifier = secure_filename(request.form.get("identifier"))
-        # Get version from db either by id or by name from the request
-        version = secure_filename(request.form.get("installer-version"))
-
-        architecture = secure_filename(request.form.get("installer-architecture"))
-        scope = request.form.get(
-            "installer-installer_scope"
-        )  # Add this to the request form
-        # Define the S3 object key with the same format as 'scope.file_extension'
-        s3_object_key = f"packages/{publisher}/{identifier}/{version}/{architecture}/{scope}.{file_extension}"
+        s3_object_key, _ = upload_object_key()
+
+        params = {
+            "Bucket": settings_snapshot.get("BUCKET_NAME"),
+            "Key": s3_object_key,
+            "ContentType": content_type,
+        }
+        # Base64 SHA256 computed by the browser, S3 rejects the upload unless the body matches and stores it
+        checksum_sha256 = request.form.get("checksum_sha256")
+        if checksum_sha256:
+            params["ChecksumAlgorithm"] = "SHA256"
+            params["ChecksumSHA256"] = checksum_sha256
 
         # Generate a pre-signed URL for S3 uploads
-        presigned_url = s3_client.generate_presigned_url(
+        presigned_url = get_s3_client().generate_presigned_url(
             "put_object",
-            Params={
-                "Bucket": Setting.get("bucket_name").get_value(),
-                "Key": s3_object_key,
-                "ContentType": content_type,
-            },
+            Params=params,
             ExpiresIn=URL_EXPIRATION_SECONDS,
         )
 
@@ -188,6 +231,7 @@ def generate_presigned_url():
                 "content_type": content_type,
                 "file_name": file_name,
                 "file_path": s3_object_key,  # Include the S3 object key for reference
+                "checksum_sha256": checksum_sha256,
             }
         )
 
@@ -195,6 +239,107 @@ def generate_presigned_url():
         return jsonify({"error": str(e)}), 500
 
 
+def get_multipart_upload(upload_id):
+    # Only the user who started an upload can continue it
+    return MultipartUpload.query.filter_by(
+        id=upload_id, user_id=current_user.id, status="active"
+    ).first()
+
+
+@api.post("/multipart_upload")
+@login_required
+@permission_required("add:installer")
+def create_multipart_upload():
+    size = request.form.get("size", type=int)
+    if not size or size <= 0 or size > multipart_uploads.max_size:
+        return jsonify({"error": "Invalid file size"}), 400
+    try:
+        s3_object_key, file_name = upload_object_key()
+        # Uploads are created far more often than abandoned, a few stale ones are cleaned up on the way
+        multipart_uploads.abort_stale(limit=10)
+        upload = multipart_uploads.create(
+            current_user.id, s3_object_key, file_name, request.form.get("content_type"), size
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to create multipart upload: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify(
+        {
+            "id": upload.id,
+            "part_size": upload.part_size,
+            "part_count": upload.part_count,
+            "file_name": upload.file_name,
+            "file_path": upload.object_key,
+            "parts_url": url_for("api.presign_multipart_parts", upload_id=upload.id),
+            "complete_url": url_for("api.complete_multipart_upload", upload_id=upload.id),
+            "abort_url": url_for("api.abort_multipart_upload", upload_id=upload.id),
+        }
+    )
+
+
+@api.post("/multipart_upload/<int:upload_id>/parts")
+@login_required
+@permission_required("add:installer")
+def presign_multipart_parts(upload_id):
+    upload = get_multipart_upload(upload_id)
+    if upload is None:
+        return "Upload not found", 404
+    part_numbers = (request.get_json(silent=True) or {}).get("part_numbers") or []
+    if len(part_numbers) > 100 or not all(
+        isinstance(number, int) and 1 <= number <= upload.part_count for number in part_numbers
+    ):
+        return jsonify({"error": "Invalid part numbers"}), 400
+    return jsonify({"urls": multipart_uploads.presign_parts(upload, part_numbers)})
+
+
+@api.get("/multipart_upload/<int:upload_id>")
+@login_required
+@permission_required("add:installer")
+def get_multipart_upload_parts(upload_id):
+    # Lets a client resume by skipping the parts S3 already has
+    upload = get_multipart_upload(upload_id)
+    if upload is None:
+        return "Upload not found", 404
+    parts = multipart_uploads.uploaded_parts(upload)
+    return jsonify({"part_count": upload.part_count, "parts": [part["PartNumber"] for part in parts]})
+
+
+@api.post("/multipart_upload/<int:upload_id>/complete")
+@login_required
+@permission_required("add:installer")
+def complete_multipart_upload(upload_id):
+    upload = get_multipart_upload(upload_id)
+    if upload is None:
+        return "Upload not found", 404
+    parts = multipart_uploads.uploaded_parts(upload)
+    missing = set(range(1, upload.part_count + 1)) - {part["PartNumber"] for part in parts}
+    if missing:
+        return jsonify({"error": f"Missing parts: {sorted(missing)[:10]}"}), 409
+    try:
+        multipart_uploads.complete(upload, parts)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to complete multipart upload: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"file_name": upload.file_name, "file_path": upload.object_key})
+
+
+@api.delete("/multipart_upload/<int:upload_id>")
+@login_required
+@permission_required("add:installer")
+def abort_multipart_upload(upload_id):
+    upload = get_multipart_upload(upload_id)
+    if upload is None:
+        return "Upload not found", 404
+    multipart_uploads.abort(upload)
+    db.session.commit()
+    return "", 204
+
+
 @api.route("/add_package", methods=["POST"])
 @login_required
 @permission_required("add:package")
@@ -237,6 +382,9 @@ def add_package():
 
     try:
         db.session.add(package)
+        package.sync_match_keys()
+        package.sync_latest_version()
+        manifest_cache.invalidate()
         db.session.commit()
         current_app.logger.info(f"Package {package.identifier} added successfully")
     except Exception as e:
@@ -259,6 +407,10 @@ def update_package(identifier):
     publisher = request.form["publisher"]
     package.name = name
     package.publisher = publisher
+    package.moniker = request.form.get("moniker") or None
+    package.tags = request.form.get("tags") or None
+    package.sync_match_keys()
+    manifest_cache.invalidate()
     db.session.commit()
     return redirect(request.referrer)
 
@@ -267,11 +419,14 @@ def update_package(identifier):
 @login_required
 @permission_required("delete:package")
 def delete_package(identifier):
-    print("wtfff")
     package = Package.query.filter_by(identifier=identifier).first()
     if package is None:
         return "Package not found", 404
+    versions = PackageVersion.query.options(installers_for_deletion()).filter_by(identifier=identifier).all()
+    # Only the rows are deleted here, the files are removed in the background
+    delete_version_installers(package, versions)
     db.session.delete(package)
+    manifest_cache.invalidate()
     db.session.commit()
     return "", 204
 
@@ -316,6 +471,9 @@ def add_version(identifier):
         version.installers.append(installer)
 
     package.versions.append(version)
+    package.sync_match_keys()
+    package.sync_latest_version()
+    manifest_cache.invalidate()
     try:
         db.session.commit()
         current_app.logger.info(
@@ -361,6 +519,8 @@ def add_installer(identifier):
             return "Error creating installer", 500
 
         version.installers.append(installer)
+        package.sync_match_keys()
+        manifest_cache.invalidate()
         db.session.commit()
 
         return redirect(request.referrer)
@@ -378,6 +538,14 @@ def edit_installer(identifier):
 
     current_app.logger.info(f"Installer found: {installer}")
 
+    for field_name in ["product_code", "upgrade_code", "package_family_name", "commands"]:
+        if field_name in request.form:
+            setattr(installer, field_name, request.form[field_name] or None)
+    package = Package.query.filter_by(identifier=identifier).first()
+    if package is not None:
+        package.sync_match_keys()
+    manifest_cache.invalidate()
+
     current_app.logger.info("Going through installer switches to update them")
     for field_name in installer_switches:
         current_app.logger.info(f"Field name: {field_name}")
@@ -429,8 +597,11 @@ def delete_installer(identifier, version, installer):
         return "Installer not found", 404
 
     delete_installer_util(package, installer, version)
+    blob_store.release([installer.storage_key])
 
     db.session.delete(installer)
+    package.sync_match_keys()
+    manifest_cache.invalidate()
     db.session.commit()
 
     return "", 200
@@ -445,16 +616,18 @@ def delete_version(identifier, version):
         current_app.logger.warning("Package not found")
         return "Package not found", 404
 
-    version = PackageVersion.query.filter_by(
+    version = PackageVersion.query.options(installers_for_deletion()).filter_by(
         identifier=identifier, version_code=version
     ).first()
     if version is None:
         current_app.logger.warning("Version not found")
         return "Version not found", 404
 
-    for installer in version.installers:
-        delete_installer_util(package, installer, version)
+    delete_version_installers(package, [version])
     db.session.delete(version)
+    package.sync_match_keys()
+    package.sync_latest_version()
+    manifest_cache.invalidate()
     try:
         db.session.commit()
         current_app.logger.info(
@@ -491,6 +664,7 @@ def update_user():
 
     user.username = username
     user.email = email
+    principals.invalidate()
     if password:
         user.set_password(password)
         db.session.commit()
@@ -523,6 +697,7 @@ def change_role(user):
         return "Role not found", 404
     old_role = user.role
     user.role = role
+    principals.invalidate()
     try:
         db.session.commit()
         current_app.logger.info(
@@ -593,6 +768,7 @@ def update_setting():
 
     # Update the setting's value
     setting.set_value(value)
+    settings_snapshot.invalidate()
     db.session.commit()
 
     return jsonify(setting.to_dict())
@@ -613,6 +789,86 @@ def whoami():
     return jsonify(current_user.to_dict())
 
 
+def token_owner(user_id):
+    """The user whose tokens the current user manages, None if it's another user and they lack edit:user."""
+    if user_id in (None, "", current_user.id, str(current_user.id)):
+        return User.query.filter_by(id=current_user.id).first()
+    if not current_user.role.has_permission("edit:user"):
+        return None
+    return User.query.filter_by(id=user_id).first()
+
+
+@api.get("/tokens")
+@login_required
+@permission_required("view:own_user")
+def list_tokens():
+    user = token_owner(request.args.get("user_id"))
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    tokens = ApiToken.query.filter_by(user_id=user.id).order_by(ApiToken.id)
+    return jsonify([token.to_dict() for token in tokens])
+
+
+@api.post("/tokens")
+@login_required
+@permission_required("edit:own_user")
+def add_token():
+    if current_user.token_id is not None:
+        return jsonify({"error": "API tokens can't create other tokens"}), 403
+    data = request.get_json(silent=True) or request.form
+    name = (data.get("name") or "").strip()
+    if not name:
+        return jsonify({"error": "name is required"}), 400
+    # Personal tokens belong to the current user, service tokens to another (service) user
+    user = token_owner(data.get("user_id"))
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+
+    permissions = {permission.name for permission in user.role.permissions} if user.role else set()
+    scopes = data.get("scopes")
+    if isinstance(scopes, str):
+        scopes = split_list(scopes)
+    scopes = sorted(permissions if not scopes else set(scopes))
+    unknown = set(scopes) - permissions
+    if unknown:
+        return jsonify({"error": f"{user.username} lacks the permissions {', '.join(sorted(unknown))}"}), 400
+
+    try:
+        expires_in = int(data.get("expires_in", current_app.config.get("API_TOKEN_EXPIRY_DAYS", 90)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "expires_in must be a number of days"}), 400
+    expires_at = datetime.utcnow() + timedelta(days=expires_in) if expires_in > 0 else None
+
+    token = generate_token()
+    api_token = ApiToken(
+        user=user,
+        name=name,
+        token_hash=token_digest(token),
+        prefix=token[:12],
+        scopes=",".join(scopes),
+        expires_at=expires_at,
+    )
+    db.session.add(api_token)
+    db.session.commit()
+    current_app.logger.info(f"API token {name} created for user {user.username}")
+    # The only time the token is shown, only its hash is stored
+    return jsonify(dict(api_token.to_dict(), token=token)), 201
+
+
+@api.delete("/tokens/<int:id>")
+@login_required
+@permission_required("edit:own_user")
+def delete_token(id):
+    api_token = ApiToken.query.filter_by(id=id).first()
+    if api_token is None or token_owner(api_token.user_id) is None:
+        return jsonify({"error": "Token not found"}), 404
+    db.session.delete(api_token)
+    principals.invalidate()
+    db.session.commit()
+    current_app.logger.info(f"API token {api_token.name} revoked")
+    return "", 200
+
+
 
 @api.route("/add_role", methods=["POST"])
 @login_required
@@ -625,6 +881,7 @@ def add_role():
         permission = Permission.query.filter_by(name=permission).first()
         role.permissions.append(permission)
     db.session.add(role)
+    principals.invalidate()
 
     try:
         db.session.commit()
@@ -650,6 +907,7 @@ def delete_role(id):
     if users:
         return "Role has users assigned to it, please remove them first", 400
     db.session.delete(role)
+    principals.invalidate()
     try:
         db.session.commit()
         current_app.logger.info(f"Role {role.name} deleted successfully")
@@ -669,6 +927,7 @@ def delete_user(id):
     if user is None:
         return "User not found", 404
     db.session.delete(user)
+    principals.invalidate()
     try:
         db.session.commit()
         current_app.logger.info(f"User {user.username} deleted")
@@ -681,54 +940,39 @@ def delete_user(id):
 
 @api.route("/download/<identifier>/<version>/<architecture>/<scope>")
 def download(identifier, version, architecture, scope):
-    # TODO: Improve this function to be more efficient, also when a package's publisher is renamed the file won't be found anymore
-    package = Package.query.filter_by(identifier=identifier).first()
-    if package is None:
-        current_app.logger.warning("Package not found")
-        return "Package not found", 404
-
-    # Get version of package and also match package
-    version_code = PackageVersion.query.filter_by(
-        version_code=version, identifier=identifier
-    ).first()
-    if version_code is None:
-        current_app.logger.warning("Version not found")
-        return "Package version not found", 404
-    # Get installer of package version and also match architecture and identifier
-    installer = Installer.query.filter_by(
-        version_id=version_code.id, architecture=architecture, scope=scope
-    ).first()
+    # TODO: When a package's publisher is renamed files stored before the blob store migration won't be found anymore
+    installer = resolve_download(identifier, version, architecture, scope)
     if installer is None:
         current_app.logger.warning("Installer not found")
         return "Installer not found", 404
 
-    if Setting.get("USE_S3").get_value() and installer.external_url is None:
+    if settings_snapshot.get("USE_S3") and installer.external_url is None:
         current_app.logger.info("Downloading from S3")
-        # Generate a pre-signed URL for the S3 object
-        presigned_url = s3_client.generate_presigned_url(
-            "get_object",
-            Params={
-                "Bucket": Setting.get("BUCKET_NAME").get_value(),
-                "Key": "packages/"
-                + package.publisher
+        # Get a pre-signed URL for the S3 object, reused until shortly before it expires
+        if installer.storage_key:
+            s3_object_key = blob_store.object_key(installer.storage_key)
+        else:
+            s3_object_key = (
+                "packages/"
+                + installer.publisher
                 + "/"
-                + package.identifier
+                + installer.identifier
                 + "/"
-                + version_code.version_code
+                + installer.version_code
                 + "/"
                 + installer.architecture
                 + "/"
-                + installer.file_name,
-                "ResponseContentDisposition": "attachment; filename="
-                + installer.file_name,
-                "ResponseContentType": "application/octet-stream",
-            },
-            ExpiresIn=URL_EXPIRATION_SECONDS,
+                + installer.file_name
+            )
+        presigned_url = presigned_urls.get(
+            get_s3_client(),
+            settings_snapshot.get("BUCKET_NAME"),
+            s3_object_key,
+            disposition="attachment; filename=" + installer.file_name,
         )
 
-        # Increment the download count and commit to the database
-        package.download_count += 1
-        db.session.commit()
+        # Increment the download count, written to the database in batches
+        download_counter.increment(installer.package_id)
 
         # Redirect the client to the pre-signed URL
         return redirect(presigned_url)
@@ -736,34 +980,31 @@ def download(identifier, version, architecture, scope):
     # If the installer has an external URL, redirect the client to it
     if installer.external_url:
         current_app.logger.info("Downloading from external URL")
-        # Increment the download count and commit to the database
-        package.download_count += 1
-        db.session.commit()
+        # Increment the download count, written to the database in batches
+        download_counter.increment(installer.package_id)
 
         # Redirect the client to the pre-signed URL
         return redirect(installer.external_url)
 
-    installer_path = os.path.join(
-        basedir,
-        "packages",
-        package.publisher,
-        package.identifier,
-        version_code.version_code,
-        installer.architecture,
-    )
+    if installer.storage_key:
+        parts = tuple(installer.storage_key.split("/"))
+    else:
+        parts = (
+            installer.publisher,
+            installer.identifier,
+            installer.version_code,
+            installer.architecture,
+            installer.file_name,
+        )
+    installer_path = os.path.join(basedir, "packages", *parts)
 
     current_app.logger.info("Starting download for package:")
-    current_app.logger.info(f"Package name: {package.name}")
-    current_app.logger.info(f"Package identifier: {package.identifier}")
-    current_app.logger.info(f"Package version: {version_code.version_code}")
+    current_app.logger.info(f"Package identifier: {installer.identifier}")
+    current_app.logger.info(f"Package version: {installer.version_code}")
     current_app.logger.info(f"Architecture: {installer.architecture}")
     current_app.logger.info(f"Installer file name: {installer.file_name}")
     current_app.logger.info(f"Installer SHA256: {installer.installer_sha256}")
-    current_app.logger.info(
-        f"Installer path: {installer_path + '/' + installer.file_name}"
-    )
-    if installer.external_url:
-        current_app.logger.info(f"External URL: {installer.external_url}")
+    current_app.logger.info(f"Installer path: {installer_path}")
 
     # Check if the Range header is present
     range_header = request.headers.get("Range")
@@ -776,8 +1017,15 @@ def download(identifier, version, architecture, scope):
             return "Invalid range header", 400
 
     # Only add to download_count for a whole file download not part of it (winget uses range)
-    if (is_partial and range_header and range_header == "bytes=0-1") or not is_partial:
-        package.download_count += 1
-        db.session.commit()
-
-    return send_from_directory(installer_path, installer.file_name, as_attachment=True)
+    if request.method != "HEAD" and (
+        (is_partial and range_header and range_header == "bytes=0-1") or not is_partial
+    ):
+        download_counter.increment(installer.package_id)
+
+    # Sent by the worker or handed off to the web server, depending on INSTALLER_DELIVERY
+    return send_installer(
+        os.path.join(basedir, "packages"),
+        parts,
+        installer.file_name,
+        etag=installer.installer_sha256,
+    )
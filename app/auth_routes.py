@@ -4,7 +4,9 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_bcrypt import Bcrypt
 
 from app.models import Role, Setting, User
-from app import db, bcrypt, permissions
+from app import db, permissions
+from app.cache import settings_snapshot
+from app.passwords import password_hasher
 auth = Blueprint('auth', __name__)
 
 @auth.route('/login')
@@ -30,7 +32,14 @@ def login_post():
 
     # check if the user actually exists
     # take the user-supplied password, hash it, and compare it to the hashed password in the database
-    if not user or not bcrypt.check_password_hash(user.password, password):
+    # Hand the connection back to the pool first, logins waiting for bcrypt would otherwise hold on to them
+    db.session.close()
+    with password_hasher.login_slot() as admitted:
+        if not admitted:
+            flash('Too many login attempts right now, please try again in a moment.', 'error')
+            return render_template('login.j2'), 429
+        valid = user is not None and password_hasher.check(user.password, password)
+    if not valid:
         flash('Please check your login details and try again.', 'error')
         return redirect(url_for('auth.login')) # if the user doesn't exist or password is wrong, reload the page
 
@@ -45,7 +54,7 @@ def signup():
     user_exists = User.query.first() is not None
     
     # If users already exist and registration is disabled, redirect to login with a flash message.
-    if user_exists and not Setting.get("ENABLE_REGISTRATION").get_value():
+    if user_exists and not settings_snapshot.get("ENABLE_REGISTRATION"):
         flash('Registration is not allowed. Please contact your administrator.', 'warning')
         return redirect(url_for('auth.login'))
     
@@ -61,7 +70,7 @@ def logout():
 @auth.route('/signup', methods=['POST'])
 def signup_post():
     # Before processing the form, check if registration is enabled and users exist
-    if User.query.first() and not Setting.get("ENABLE_REGISTRATION").get_value():
+    if User.query.first() and not settings_snapshot.get("ENABLE_REGISTRATION"):
         flash('Registration is disabled.', 'error')
         return redirect(url_for('auth.login'))
 
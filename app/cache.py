@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from types import MappingProxyType
+
+from flask import current_app
+
+from app.models import ChangeStamp, Setting
+
+
+class StampedCache:
+    """Base for per-worker caches that are dropped whenever their ChangeStamp moves.
+
+    The stamp lives in the database so a write in one gunicorn worker invalidates the cache in all of them,
+    the stamp is re-read at most once every ``check_interval`` seconds.
+    """
+    _by_stamp = defaultdict(list)
+
+    def __init__(self, stamp, check_interval=1.0):
+        self.stamp = stamp
+        self.check_interval = check_interval
+        self._version = None
+        self._checked_at = 0.0
+        StampedCache._by_stamp[stamp].append(self)
+
+    def init_app(self, app):
+        self.check_interval = app.config.get('CACHE_STAMP_INTERVAL', self.check_interval)
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+        version = ChangeStamp.current(self.stamp)
+        if version != self._version:
+            self.clear()
+            self._version = version
+        self._checked_at = now
+
+    def clear(self):
+        raise NotImplementedError
+
+    def invalidate(self):
+        """Bump the shared stamp, the bump is committed together with the caller's session.
+
+        Every cache of this worker watching the same stamp is cleared right away.
+        """
+        ChangeStamp.bump(self.stamp)
+        for cache in StampedCache._by_stamp[self.stamp]:
+            cache.clear()
+            cache._version = None
+
+
+class VersionedCache(StampedCache):
+    """A bounded LRU cache invalidated through a ChangeStamp."""
+
+    def __init__(self, stamp, maxsize=256, check_interval=1.0):
+        super().__init__(stamp, check_interval)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, maxsize_key=None):
+        super().init_app(app)
+        if maxsize_key:
+            self.maxsize = app.config.get(maxsize_key, self.maxsize)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key):
+        self._sync()
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class SettingsSnapshot(StampedCache):
+    """Typed, read-only values of every Setting with the app.config overrides already applied."""
+
+    def __init__(self, check_interval=1.0):
+        super().__init__('settings', check_interval)
+        self._values = None
+
+    def clear(self):
+        self._values = None
+
+    def _load(self):
+        # Resolve environment overrides once per snapshot instead of scanning app.config on every lookup
+        overrides = {key.upper(): value for key, value in current_app.config.items()}
+        return MappingProxyType({
+            setting.key.upper(): setting.get_value(overrides) for setting in Setting.query.all()
+        })
+
+    def all(self):
+        self._sync()
+        values = self._values
+        if values is None:
+            values = self._values = self._load()
+        return values
+
+    def get(self, key, default=None):
+        return self.all().get(key.upper(), default)
+
+
+# Serialized /wg/packageManifests responses keyed by (host, identifier)
+manifest_cache = VersionedCache('manifests')
+# InstallerRoute of each download URL keyed by (identifier, version, architecture, scope), same writes invalidate it
+download_routes = VersionedCache('manifests', maxsize=4096)
+# Number of packages matching each /api/packages search, same writes invalidate it
+package_counts = VersionedCache('manifests', maxsize=256)
+settings_snapshot = SettingsSnapshot()
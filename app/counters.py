@@ -0,0 +1,87 @@
+import atexit
+import threading
+from collections import Counter
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import Package
+
+
+class DownloadCounter:
+    """Buffers download count increments per worker and writes them in batches.
+
+    Each flush runs one executemany of ``UPDATE package SET download_count = download_count + n``, so concurrent
+    workers never lose increments and the request path never waits for a write lock. The timer thread flushes the
+    buffer after ``flush_interval`` seconds or right away once ``flush_threshold`` downloads are pending, and it is
+    flushed when the worker exits.
+    """
+
+    def __init__(self, flush_interval=5.0, flush_threshold=100):
+        self.app = None
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = Counter()
+        self._buffered = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('DOWNLOAD_COUNT_FLUSH_INTERVAL', self.flush_interval)
+        self.flush_threshold = app.config.get('DOWNLOAD_COUNT_FLUSH_THRESHOLD', self.flush_threshold)
+        atexit.register(self.flush)
+
+    def increment(self, package_id, count=1):
+        with self._lock:
+            self._pending[package_id] += count
+            self._buffered += count
+            self._schedule(0 if self._buffered >= self.flush_threshold else self.flush_interval)
+
+    def _schedule(self, delay=None):
+        # Started lazily so no thread exists before gunicorn forks its workers
+        delay = self.flush_interval if delay is None else delay
+        if self._timer is not None:
+            if self._timer.interval <= delay:
+                return
+            # Brought forward, a full buffer is flushed by a new timer instead of in the request that filled it
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._buffered = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending or self.app is None:
+            return
+
+        table = Package.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam('package_id'))
+            .values(download_count=table.c.download_count + bindparam('count'))
+        )
+        # Sorted so workers flushing at the same time take row locks in the same order
+        params = [{'package_id': package_id, 'count': count} for package_id, count in sorted(pending.items())]
+
+        # A fresh app context gets its own session, independent of any request being served
+        with self.app.app_context():
+            try:
+                db.session.execute(statement, params)
+                db.session.commit()
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                self.app.logger.error(f"Failed to flush download counts, retrying later: {error}")
+                with self._lock:
+                    self._pending.update(pending)
+                    self._buffered += sum(pending.values())
+                    self._schedule()
+
+
+download_counter = DownloadCounter()
@@ -10,10 +10,8 @@ def permission_required(permission):
             if not current_user.is_authenticated:
                 abort(401)  # Return an unauthorized status code if the user is not authenticated
 
-            user_role = current_user.role
-
-            # Check if the user's role has the required permission
-            if not user_role.has_permission(permission):
+            # current_user is the cached principal, its role checks a frozenset without querying, see app.principals
+            if not current_user.role.has_permission(permission):
                 # If not html return error code and message
                 if request.content_type == 'application/json':
                     print("You\'re missing permissions to access this resource.")
@@ -0,0 +1,145 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, current_app, request
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, is_resource_modified, parse_date, parse_range_header, quote_etag
+from werkzeug.security import safe_join
+
+DELIVERY_MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+CHUNK_SIZE = 1024 * 1024
+# More ranges than this in one request are ignored and the whole file is sent instead
+MAX_RANGES = 16
+
+
+def send_installer(directory, parts, download_name, etag=None):
+    """Respond with the installer stored at ``directory/parts...``, offered to the client as ``download_name``.
+
+    Depending on INSTALLER_DELIVERY the bytes are sent by the worker itself (``direct``) or the response only
+    names the file and the web server in front of gunicorn streams it (``x-accel-redirect`` for nginx,
+    ``x-sendfile`` for Apache and lighttpd), which then also answers Range requests.
+    """
+    path = safe_join(directory, *parts)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    mode = current_app.config.get('INSTALLER_DELIVERY', 'direct')
+    if mode not in DELIVERY_MODES:
+        current_app.logger.warning(f"Unknown installer delivery mode {mode}, sending directly")
+        mode = 'direct'
+
+    headers = {
+        'Content-Disposition': 'attachment; filename=' + download_name,
+        'Accept-Ranges': 'bytes',
+    }
+    if mode == 'x-accel-redirect':
+        prefix = current_app.config.get('INSTALLER_ACCEL_PREFIX', '/protected-packages/')
+        headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + '/'.join(quote(part) for part in parts)
+        return Response(headers=headers, content_type='application/octet-stream')
+    if mode == 'x-sendfile':
+        headers['X-Sendfile'] = path
+        return Response(headers=headers, content_type='application/octet-stream')
+    return _send_direct(path, headers, etag)
+
+
+def _satisfiable_ranges(range_header, size):
+    ranges = []
+    for start, stop in range_header.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def _if_range_matches(etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Only a strong validator may be used for If-Range
+        return etag is not None and if_range == quote_etag(etag)
+    date = parse_date(if_range)
+    return date is not None and date == last_modified
+
+
+def _read_range(path, start, stop):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _file_body(path, start, stop):
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is None:
+        return _read_range(path, start, stop)
+    # The server sends exactly Content-Length bytes from the current offset, gunicorn does it with os.sendfile
+    file = open(path, 'rb')
+    file.seek(start)
+    return file_wrapper(file, CHUNK_SIZE)
+
+
+def _part_header(boundary, start, stop, size):
+    return (
+        f'\r\n--{boundary}\r\n'
+        'Content-Type: application/octet-stream\r\n'
+        f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+    ).encode()
+
+
+def _multipart_body(path, ranges, size, boundary):
+    for start, stop in ranges:
+        yield _part_header(boundary, start, stop, size)
+        yield from _read_range(path, start, stop)
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def _send_direct(path, headers, etag):
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    headers['Last-Modified'] = http_date(last_modified)
+    if etag:
+        headers['ETag'] = quote_etag(etag)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    is_head = request.method == 'HEAD'
+    range_header = parse_range_header(request.headers.get('Range'))
+    if range_header is not None and range_header.units == 'bytes' and len(range_header.ranges) <= MAX_RANGES \
+            and _if_range_matches(etag, last_modified):
+        ranges = _satisfiable_ranges(range_header, size)
+        if not ranges:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+            headers['Content-Length'] = str(stop - start)
+            body = () if is_head else _file_body(path, start, stop)
+            return Response(body, status=206, headers=headers, content_type='application/octet-stream',
+                            direct_passthrough=True)
+
+        boundary = uuid.uuid4().hex
+        length = len(f'\r\n--{boundary}--\r\n')
+        length += sum(len(_part_header(boundary, start, stop, size)) + stop - start for start, stop in ranges)
+        headers['Content-Length'] = str(length)
+        body = () if is_head else _multipart_body(path, ranges, size, boundary)
+        return Response(body, status=206, headers=headers, content_type=f'multipart/byteranges; boundary={boundary}',
+                        direct_passthrough=True)
+
+    headers['Content-Length'] = str(size)
+    body = () if is_head else _file_body(path, 0, size)
+    return Response(body, headers=headers, content_type='application/octet-stream', direct_passthrough=True)
@@ -7,7 +7,7 @@ from flask_wtf.file import FileField, FileAllowed, FileRequired
 import wtforms
 from wtforms import Form, StringField, SelectField, validators, ValidationError
 
-from app.models import Setting
+from app.cache import settings_snapshot
 from . import constants
 class RequiredIf(object):
 
@@ -79,7 +79,7 @@ class AddInstallerFormFields(FlaskForm):
             self.file.validators.append(Optional())
             self.url.validators.append(Optional())  # Both fields are optional when file_required is False
 
-        if Setting.get("USE_S3").get_value() and file_required:
+        if settings_snapshot.get("USE_S3") and file_required:
             self.is_aws.validators.append(InputRequired())
 
 
@@ -108,6 +108,14 @@ class AddInstallerFormFields(FlaskForm):
     nestedinstallerpath = StringField('Nested Installer Path', validators=[
         RequiredIf(installer_type='zip')
         ])
+
+    product_code = StringField('Product Code', validators=[Optional(), Length(max=255)])
+
+    upgrade_code = StringField('Upgrade Code', validators=[Optional(), Length(max=255)])
+
+    package_family_name = StringField('Package Family Name', validators=[Optional(), Length(max=255)])
+
+    commands = StringField('Commands', validators=[Optional(), Length(max=255)])
     
 class AddInstallerFormFieldsWithoutFile(AddInstallerFormFields):
     def __init__(self, *args, **kwargs):
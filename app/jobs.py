@@ -0,0 +1,289 @@
+import base64
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import after_this_request, has_request_context
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_, select, update
+
+from app import db
+from app.cache import manifest_cache, settings_snapshot
+from app.models import HashJob, Installer
+from app.storage import blob_store, get_s3_client
+
+CHUNK_SIZE = 1024 * 1024
+MAX_CONTENT_LENGTH = 1024 * 1024 * 1024 * 10  # 10GB
+# Seconds between two progress writes of a running job, each write also renews the job's lease
+PROGRESS_INTERVAL = 2.0
+# Ranged reads used to hash S3 objects that have no stored SHA256 checksum
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_CONCURRENCY = 4
+
+
+def hash_url(session, url, progress=None, max_content_length=MAX_CONTENT_LENGTH):
+    """Download ``url`` and return its SHA256 hash, ``progress(bytes_done, bytes_total)`` is called per chunk."""
+    # Ensure the URL uses HTTPS
+    if not url.startswith("https://"):
+        raise ValueError("URL must use HTTPS.")
+
+    with session.get(url, stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        total = int(response.headers.get('content-length', 0)) or None
+        if total and total > max_content_length:
+            raise ValueError(f"Content length exceeds allowed limit of {max_content_length} bytes.")
+
+        hash_sha256 = hashlib.sha256()
+        done = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            hash_sha256.update(chunk)
+            done += len(chunk)
+            if done > max_content_length:
+                raise ValueError(f"Content length exceeds allowed limit of {max_content_length} bytes.")
+            if progress is not None:
+                progress(done, total)
+    return hash_sha256.hexdigest()
+
+
+def s3_checksum_sha256(key):
+    """Return the hex SHA256 S3 verified and stored for an object on upload, None if it has no full object checksum."""
+    response = get_s3_client().head_object(
+        Bucket=settings_snapshot.get("BUCKET_NAME"), Key=key, ChecksumMode='ENABLED'
+    )
+    checksum = response.get('ChecksumSHA256')
+    # Multipart uploads only carry a checksum of their part checksums, suffixed with the part count
+    if not checksum or '-' in checksum or response.get('ChecksumType') == 'COMPOSITE':
+        return None
+    return base64.b64decode(checksum).hex()
+
+
+def hash_s3_object(key, progress=None, part_size=S3_PART_SIZE, concurrency=S3_CONCURRENCY):
+    """Hash an S3 object with parallel ranged GETs, the parts are fed into one SHA256 in order.
+
+    At most ``concurrency`` parts are in flight, so memory use stays bounded whatever the object size.
+    """
+    client = get_s3_client()
+    bucket = settings_snapshot.get("BUCKET_NAME")
+    head = client.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+
+    def read(start):
+        end = min(start + part_size, size) - 1
+        # IfMatch fails the read instead of mixing parts of two versions if the object is replaced meanwhile
+        response = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}', IfMatch=head['ETag'])
+        return response['Body'].read()
+
+    hash_sha256 = hashlib.sha256()
+    done = 0
+    starts = iter(range(0, size, part_size))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = deque(executor.submit(read, start) for _, start in zip(range(concurrency), starts))
+        while in_flight:
+            data = in_flight.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                in_flight.append(executor.submit(read, start))
+            hash_sha256.update(data)
+            done += len(data)
+            if progress is not None:
+                progress(done, size)
+    return hash_sha256.hexdigest()
+
+
+class HashJobQueue:
+    """Database backed queue of HashJobs, worked off by a small pool of threads in every worker process.
+
+    A job is claimed with a conditional UPDATE, so it runs in one worker even with several gunicorn processes
+    polling the same table. Failed attempts are retried with exponential backoff until ``max_attempts``.
+    """
+
+    def __init__(self, workers=2, poll_interval=5.0, lease=60, max_attempts=5):
+        self.app = None
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._threads = []
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('HASH_JOB_WORKERS', self.workers)
+        self.poll_interval = app.config.get('HASH_JOB_POLL_INTERVAL', self.poll_interval)
+        self.lease = app.config.get('HASH_JOB_LEASE', self.lease)
+        self.max_attempts = app.config.get('HASH_JOB_MAX_ATTEMPTS', self.max_attempts)
+        app.before_request(self.start)
+        app.cli.add_command(hash_cli)
+
+    def start(self):
+        # Started on the first request so the threads are created after gunicorn forked the worker
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'hash-job-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, installer, source, location):
+        """Mark ``installer`` as pending and queue the job computing its hash, committed with the caller's session."""
+        installer.installer_sha256 = None
+        installer.hash_pending = True
+        installer.hash_job = HashJob(source=source, location=location)
+        if has_request_context():
+            @after_this_request
+            def wake_workers(response):
+                self._wake.set()
+                return response
+
+    def _session(self):
+        # One session per thread keeps connections to the same host alive across jobs
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            # Imported here, requests and urllib3 are only needed once an external installer is hashed
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            retry = Retry(total=3, backoff_factor=1, status_forcelist=(502, 503, 504), allowed_methods=['GET'])
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(max_retries=retry))
+            self._local.session = session
+        return session
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    ran = self.run_next()
+            except Exception as error:
+                self.app.logger.error(f"Hash job worker failed: {error}")
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        claimable = or_(
+            and_(HashJob.status == 'pending', HashJob.run_after <= now),
+            and_(HashJob.status == 'running', HashJob.locked_until < now),
+        )
+        while True:
+            job_id = db.session.execute(select(HashJob.id).where(claimable).order_by(HashJob.id).limit(1)).scalar()
+            if job_id is None:
+                db.session.rollback()
+                return None
+            claimed = db.session.execute(
+                update(HashJob)
+                .where(HashJob.id == job_id, claimable)
+                .values(
+                    status='running',
+                    attempts=HashJob.attempts + 1,
+                    bytes_done=0,
+                    locked_until=now + timedelta(seconds=self.lease),
+                )
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(HashJob, job_id)
+
+    def run_next(self):
+        """Claim and run the next due job, returns False when there was none."""
+        job = self._claim()
+        if job is None:
+            return False
+        job_id, installer_id, source, location = job.id, job.installer_id, job.source, job.location
+        self.app.logger.info(f"Hashing installer {installer_id} from {source} (attempt {job.attempts})")
+
+        reported_at = time.monotonic()
+
+        def progress(done, total):
+            nonlocal reported_at
+            if time.monotonic() - reported_at < PROGRESS_INTERVAL:
+                return
+            reported_at = time.monotonic()
+            db.session.execute(
+                update(HashJob)
+                .where(HashJob.id == job_id)
+                .values(bytes_done=done, bytes_total=total,
+                        locked_until=datetime.utcnow() + timedelta(seconds=self.lease))
+            )
+            db.session.commit()
+
+        try:
+            if source == 's3':
+                sha256 = hash_s3_object(location, progress)
+            else:
+                sha256 = hash_url(self._session(), location, progress)
+        except Exception as error:
+            db.session.rollback()
+            self._retry_or_fail(job_id, error)
+            return True
+
+        job = db.session.get(HashJob, job_id)
+        installer = db.session.get(Installer, installer_id)
+        if job is None or installer is None:
+            # The installer was deleted while it was being hashed
+            db.session.rollback()
+            return True
+        if source == 's3':
+            installer.storage_key = blob_store.store_s3(location, sha256)
+        installer.installer_sha256 = sha256
+        installer.hash_pending = False
+        db.session.delete(job)
+        manifest_cache.invalidate()
+        db.session.commit()
+        self.app.logger.info(f"Installer {installer_id} hashed: {sha256}")
+        return True
+
+    def _retry_or_fail(self, job_id, error):
+        job = db.session.get(HashJob, job_id)
+        if job is None:
+            return
+        self.app.logger.warning(f"Hashing installer {job.installer_id} failed (attempt {job.attempts}): {error}")
+        job.last_error = str(error)[:500]
+        job.locked_until = None
+        if job.attempts >= self.max_attempts:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.run_after = datetime.utcnow() + timedelta(seconds=min(30 * 2 ** (job.attempts - 1), 3600))
+        db.session.commit()
+
+
+hash_jobs = HashJobQueue()
+hash_cli = AppGroup('hashes', help='Manage installer hashing jobs.')
+
+
+@hash_cli.command('run')
+def run_command():
+    """Work off every due hashing job in the foreground."""
+    count = 0
+    while hash_jobs.run_next():
+        count += 1
+    click.echo(f"Ran {count} hashing jobs.")
+
+
+@hash_cli.command('list')
+def list_command():
+    """Show queued, running and failed hashing jobs."""
+    for job in HashJob.query.order_by(HashJob.id).all():
+        progress = f"{job.bytes_done}/{job.bytes_total or '?'} bytes"
+        error = f" - {job.last_error}" if job.last_error else ""
+        click.echo(f"{job.id}: installer {job.installer_id} {job.status}, attempt {job.attempts}, {progress}{error}")
+
+
+@hash_cli.command('retry')
+def retry_command():
+    """Queue failed hashing jobs again."""
+    count = HashJob.query.filter_by(status='failed').update(
+        {HashJob.status: 'pending', HashJob.attempts: 0, HashJob.run_after: datetime.utcnow()}
+    )
+    db.session.commit()
+    click.echo(f"Queued {count} failed hashing jobs again.")
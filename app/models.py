@@ -1,11 +1,17 @@
 import dataclasses
 from datetime import datetime
-from distutils.version import LooseVersion
 import json
-from app import db, bcrypt
+from app import db
+from app.versions import version_sort_key
 from flask import url_for, current_app
 import os
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
+
+
+def split_list(value):
+    """Split a comma separated column (tags, commands) into its stripped, non-empty items."""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
 
 
 @dataclasses.dataclass
@@ -14,10 +20,25 @@ class Package(db.Model):
     identifier = db.Column(db.String(255), unique=True, nullable=False)
     name = db.Column(db.String(255), nullable=False)
     publisher = db.Column(db.String(255), nullable=False)
+    # Newest version first
     versions = db.relationship(
-        "PackageVersion", backref="package", cascade="all, delete-orphan"
+        "PackageVersion",
+        backref="package",
+        cascade="all, delete-orphan",
+        foreign_keys="PackageVersion.identifier",
+        order_by="PackageVersion.version_sort_key.desc()",
     )
+    # Highest version by version_sort_key, kept up to date by sync_latest_version()
+    latest_version_id = db.Column(
+        db.Integer, db.ForeignKey("package_version.id", ondelete="SET NULL", use_alter=True), nullable=True
+    )
+    latest_version = db.relationship("PackageVersion", foreign_keys=[latest_version_id], post_update=True)
     download_count = db.Column(db.Integer, default=0)
+    moniker = db.Column(db.String(100), nullable=True)
+    tags = db.Column(db.String(255), nullable=True)
+    match_keys = db.relationship(
+        "PackageMatchKey", backref="package", cascade="all, delete-orphan"
+    )
 
     def to_dict(self):
         return {
@@ -26,13 +47,60 @@ class Package(db.Model):
             "name": self.name,
             "publisher": self.publisher,
             "download_count": self.download_count,
-            "versions": sorted(
-                [version.to_dict() for version in self.versions],
-                key=lambda x: LooseVersion(x["version_code"]),
-                reverse=True,
-            ),
+            "moniker": self.moniker,
+            "tags": self.tags,
+            "latest_version_id": self.latest_version_id,
+            "versions": [version.to_dict() for version in self.versions],
         }
 
+    def sync_latest_version(self):
+        """Point latest_version_id at the highest version, flushes pending changes to find it."""
+        self.latest_version_id = (
+            db.session.query(PackageVersion.id)
+            .filter(PackageVersion.identifier == self.identifier)
+            .order_by(PackageVersion.version_sort_key.desc(), PackageVersion.id.desc())
+            .limit(1)
+            .scalar()
+        )
+
+    def sync_match_keys(self):
+        """Rebuild the PackageMatchKey rows from this package and the installers of all its versions."""
+        keys = set()
+        for tag in split_list(self.tags):
+            keys.add(("Tag", tag))
+        if self.moniker:
+            keys.add(("Moniker", self.moniker))
+
+        installers = (
+            db.session.query(
+                Installer.product_code,
+                Installer.package_family_name,
+                Installer.upgrade_code,
+                Installer.commands,
+            )
+            .join(PackageVersion)
+            .filter(PackageVersion.identifier == self.identifier)
+        )
+        for product_code, package_family_name, upgrade_code, commands in installers:
+            keys.update(
+                (field, value)
+                for field, value in [
+                    ("ProductCode", product_code),
+                    ("PackageFamilyName", package_family_name),
+                    ("UpgradeCode", upgrade_code),
+                ]
+                if value
+            )
+            keys.update(("Command", command) for command in split_list(commands))
+
+        keys = {(field, PackageMatchKey.normalize(value)) for field, value in keys}
+        existing = {(key.field, key.value): key for key in self.match_keys}
+        for key, match_key in existing.items():
+            if key not in keys:
+                self.match_keys.remove(match_key)
+        for field, value in keys - existing.keys():
+            self.match_keys.append(PackageMatchKey(field=field, value=value))
+
     def generate_output(self):
         output = {
             "Data": {
@@ -56,12 +124,17 @@ class Package(db.Model):
         return version_data
 
     def _get_default_locale(self, version):
-        return {
+        default_locale = {
             "PackageLocale": version.package_locale,
             "Publisher": self.publisher,
             "PackageName": self.name,
             "ShortDescription": version.short_description,
         }
+        if self.moniker:
+            default_locale["Moniker"] = self.moniker
+        if self.tags:
+            default_locale["Tags"] = split_list(self.tags)
+        return default_locale
 
     def _get_installer_data(self, version):
         installer_data = []
@@ -90,6 +163,7 @@ class Package(db.Model):
                         data["NestedInstallerFiles"] = self._get_nested_installer_data(
                             installer
                         )
+                    data.update(self._get_installer_match_fields(installer))
                     installer_data.append(data)
             else:
                 data = {
@@ -113,6 +187,7 @@ class Package(db.Model):
                     data["NestedInstallerFiles"] = self._get_nested_installer_data(
                         installer
                     )
+                data.update(self._get_installer_match_fields(installer))
                 installer_data.append(data)
         return installer_data
 
@@ -122,6 +197,18 @@ class Package(db.Model):
             switches[switch.parameter] = switch.value
         return switches
 
+    def _get_installer_match_fields(self, installer):
+        fields = {}
+        if installer.product_code:
+            fields["ProductCode"] = installer.product_code
+        if installer.package_family_name:
+            fields["PackageFamilyName"] = installer.package_family_name
+        if installer.upgrade_code:
+            fields["AppsAndFeaturesEntries"] = [{"UpgradeCode": installer.upgrade_code}]
+        if installer.commands:
+            fields["Commands"] = split_list(installer.commands)
+        return fields
+
     def _get_nested_installer_data(self, installer):
         nested_installer_data = []
         for nested_installer_file in installer.nested_installer_files:
@@ -140,11 +227,9 @@ class Package(db.Model):
             "Versions": [],
         }
 
+        # manifestSearch only loads versions that have at least one installer, see PackageVersion.has_installers
         for version in self.versions:
-            version_data = {"PackageVersion": version.version_code}
-            # Only append version if there's at least one installer
-            if version.installers:
-                output["Versions"].append(version_data)
+            output["Versions"].append({"PackageVersion": version.version_code})
 
         return output
 
@@ -153,12 +238,26 @@ class PackageVersion(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     identifier = db.Column(db.String(50), db.ForeignKey("package.identifier"))
     version_code = db.Column(db.String(50))
+    # version_code encoded by app.versions.version_sort_key, ordering by it orders like WinGet compares versions
+    version_sort_key = db.Column(db.String(255))
     default_locale = db.Column(db.String(50))
     package_locale = db.Column(db.String(50))
     short_description = db.Column(db.String(50))
     date_added = db.Column(db.DateTime, default=datetime.now())
     installers = db.relationship("Installer", backref="package_version", lazy=True)
 
+    __table_args__ = (db.Index("ix_package_version_identifier_sort_key", "identifier", "version_sort_key"),)
+
+    @validates("version_code")
+    def validate_version_code(self, key, version_code):
+        self.version_sort_key = version_sort_key(version_code)
+        return version_code
+
+    @staticmethod
+    def has_installers():
+        """SQL condition (an EXISTS subquery) matching versions that have at least one published installer."""
+        return PackageVersion.installers.any(Installer.is_published())
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -175,7 +274,7 @@ class PackageVersion(db.Model):
 
 class Installer(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    version_id = db.Column(db.Integer, db.ForeignKey("package_version.id"))
+    version_id = db.Column(db.Integer, db.ForeignKey("package_version.id"), index=True)
     architecture = db.Column(db.String(50))
     installer_type = db.Column(db.String(50))
     file_name = db.Column(db.String(100), nullable=True)
@@ -187,6 +286,19 @@ class Installer(db.Model):
     nested_installer_files = db.relationship(
         "NestedInstallerFile", backref="installer", lazy=True
     )
+    product_code = db.Column(db.String(255), nullable=True)
+    package_family_name = db.Column(db.String(255), nullable=True)
+    upgrade_code = db.Column(db.String(255), nullable=True)
+    commands = db.Column(db.String(255), nullable=True)
+    # Key of the content-addressed blob holding the file, None for external URLs and files under the old layout
+    storage_key = db.Column(db.String(100), nullable=True, index=True)
+    # Set while a HashJob computes installer_sha256, the WinGet endpoints don't publish the installer until then
+    hash_pending = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    hash_job = db.relationship("HashJob", backref="installer", uselist=False, cascade="all, delete-orphan")
+
+    @staticmethod
+    def is_published():
+        return Installer.hash_pending.is_(False)
 
     def to_dict(self):
         return {
@@ -201,6 +313,12 @@ class Installer(db.Model):
             "installer_sha256": self.installer_sha256,
             "scope": self.scope,
             "switches": [switch.to_dict() for switch in self.switches],
+            "product_code": self.product_code,
+            "package_family_name": self.package_family_name,
+            "upgrade_code": self.upgrade_code,
+            "commands": self.commands,
+            "hash_pending": self.hash_pending,
+            "hash_job": self.hash_job.to_dict() if self.hash_job else None,
             "installer_url": url_for('api.download', identifier=self.package_version.package.identifier, version=self.package_version.version_code, architecture=self.architecture, scope=self.scope, _external=True, _scheme='https')
         }
 
@@ -218,6 +336,22 @@ class Installer(db.Model):
         }
 
 
+class PackageMatchKey(db.Model):
+    """A case-folded value of a WinGet PackageMatchField that isn't a package column, indexed for manifestSearch."""
+    FIELDS = ("ProductCode", "PackageFamilyName", "Moniker", "Tag", "Command", "UpgradeCode")
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    package_id = db.Column(db.Integer, db.ForeignKey("package.id"), nullable=False, index=True)
+    field = db.Column(db.String(50), nullable=False)
+    value = db.Column(db.String(255), nullable=False)
+
+    __table_args__ = (db.Index("ix_package_match_key_field_value", "field", "value"),)
+
+    @staticmethod
+    def normalize(value):
+        return value.strip().casefold()
+
+
 class NestedInstallerFile(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     installer_id = db.Column(db.Integer, db.ForeignKey("installer.id"))
@@ -273,8 +407,8 @@ class User(UserMixin, db.Model):
     role = db.relationship("Role", back_populates="users")
 
     def set_password(self, password):
-        hashed_password = bcrypt.generate_password_hash(password).decode("utf-8")
-        self.password = hashed_password
+        from app.passwords import password_hasher
+        self.password = password_hasher.hash(password)
 
     def to_dict(self):
         return {
@@ -345,36 +479,28 @@ class Setting(db.Model):
         else:
             self.value = value
 
-    def get_value(self):
-        # Convert self.key to uppercase for case-insensitive comparison
-        upper_key = self.key.upper()
-
-        # First, check if the setting is defined in app.config in a case-insensitive manner
-        if upper_key in (k.upper() for k in current_app.config):
-            app_config_value = current_app.config[upper_key]
-            # Return the app config value, converting it to the correct type
-            if self.type == "integer":
-                return int(app_config_value)
-            elif self.type == "boolean":
-                return app_config_value.lower() == "true" if isinstance(app_config_value, str) else bool(app_config_value)
-            elif self.type == "float":
-                return float(app_config_value)
-            elif self.type == "json":
-                return json.loads(app_config_value) if isinstance(app_config_value, str) else app_config_value
-            else:
-                return app_config_value
+    def parse(self, value):
+        """Convert a raw database or app.config value to this setting's type."""
+        if self.type == "integer":
+            return int(value)
+        elif self.type == "boolean":
+            return value.lower() == "true" if isinstance(value, str) else bool(value)
+        elif self.type == "float":
+            return float(value)
+        elif self.type == "json":
+            return json.loads(value) if isinstance(value, str) else value
         else:
-            # Otherwise, return the value from the database, as before
-            if self.type == "integer":
-                return int(self.value)
-            elif self.type == "boolean":
-                return self.value.lower() == "true"
-            elif self.type == "float":
-                return float(self.value)
-            elif self.type == "json":
-                return json.loads(self.value)
-            else:
-                return self.value
+            return value
+
+    def get_value(self, config_overrides=None):
+        # Settings defined in app.config (e.g. through environment variables) take precedence over the database,
+        # keys are compared case-insensitively
+        if config_overrides is None:
+            config_overrides = {k.upper(): v for k, v in current_app.config.items()}
+        upper_key = self.key.upper()
+        if upper_key in config_overrides:
+            return self.parse(config_overrides[upper_key])
+        return self.parse(self.value)
 
     def get(key):
         key = key.lower()
@@ -391,3 +517,155 @@ class Setting(db.Model):
             "depends_on": self.depends_on,
             "is_env": upper_key in (k.upper() for k in current_app.config)
         }
+
+
+class ChangeStamp(db.Model):
+    """A counter shared by every worker, bumped whenever the data behind an in-process cache changes."""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current(name):
+        return db.session.query(ChangeStamp.value).filter_by(name=name).scalar() or 0
+
+    @staticmethod
+    def bump(name):
+        # Atomic increment so concurrent writers never lose a bump, the row is created on first use
+        updated = ChangeStamp.query.filter_by(name=name).update(
+            {ChangeStamp.value: ChangeStamp.value + 1}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(ChangeStamp(name=name, value=1))
+
+
+class SeedState(db.Model):
+    """Fingerprint of the roles, permissions and settings a worker last reconciled, see app.seed."""
+    name = db.Column(db.String(50), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False, default="")
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class HashJob(db.Model):
+    """Computes the SHA256 of an installer stored at an external URL or uploaded to S3, see app.jobs."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    installer_id = db.Column(db.Integer, db.ForeignKey("installer.id", ondelete="CASCADE"), unique=True, nullable=False)
+    # "url" for external installers, "s3" for objects uploaded through a presigned URL
+    source = db.Column(db.String(10), nullable=False)
+    location = db.Column(db.String(1024), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    bytes_done = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_total = db.Column(db.BigInteger, nullable=True)
+    last_error = db.Column(db.String(500), nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # A running job whose lease ran out belonged to a worker that died, another worker takes it over
+    locked_until = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "installer_id": self.installer_id,
+            "source": self.source,
+            "status": self.status,
+            "attempts": self.attempts,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "last_error": self.last_error,
+            "updated_at": self.updated_at,
+        }
+
+
+class MultipartUpload(db.Model):
+    """A browser upload to S3 split into parts, tracked so abandoned uploads can be aborted."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    # UploadId S3 assigned to the upload
+    upload_id = db.Column(db.String(1024), nullable=False)
+    object_key = db.Column(db.String(1024), nullable=False)
+    file_name = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    part_size = db.Column(db.BigInteger, nullable=False)
+    # "active" until the upload is completed or aborted
+    status = db.Column(db.String(20), nullable=False, default="active", index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    @property
+    def part_count(self):
+        return -(-self.size // self.part_size)
+
+
+class StorageDeletion(db.Model):
+    """A stored installer file waiting to be deleted in the background, see app.storage.StorageDeletionQueue."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Bucket holding the object, None for files in the local packages directory
+    bucket = db.Column(db.String(255), nullable=True)
+    # Object key in the bucket or path relative to the app directory, always "packages/..."
+    path = db.Column(db.String(1024), nullable=False)
+    # Set for blobs, which are kept if an installer references them again by the time the deletion runs
+    storage_key = db.Column(db.String(100), nullable=True, index=True)
+    # "pending" until the attempts are used up, then "failed"
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(500), nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    # Random token of the worker that claimed the deletion last
+    claimed_by = db.Column(db.String(32), nullable=True, index=True)
+
+
+class StorageOrphan(db.Model):
+    """A stored file no installer references, reclaimed by "flask storage gc" once it stayed unreferenced long enough."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Bucket holding the object, None for files in the local packages directory
+    bucket = db.Column(db.String(255), nullable=True)
+    path = db.Column(db.String(1024), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    first_seen = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class StorageScan(db.Model):
+    """Progress of a "flask storage gc" run, an interrupted run continues after ``last_path``."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    bucket = db.Column(db.String(255), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    last_path = db.Column(db.String(1024), nullable=True)
+    # Blob keys up to this one were already checked for missing objects
+    last_blob_key = db.Column(db.String(100), nullable=True)
+    objects = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    orphans = db.Column(db.Integer, nullable=False, default=0)
+    reclaimed = db.Column(db.Integer, nullable=False, default=0)
+    missing = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ApiToken(db.Model):
+    """A bearer token for the API, acting as its user with at most the permissions in ``scopes``, see app.tokens."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    user = db.relationship("User", backref=db.backref("api_tokens", cascade="all, delete-orphan"))
+    name = db.Column(db.String(100), nullable=False)
+    # HMAC-SHA256 of the token, the token itself is only shown once when it is created
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    # First characters of the token so users can tell their tokens apart
+    prefix = db.Column(db.String(12), nullable=False)
+    # Comma separated permission names
+    scopes = db.Column(db.String(1024), nullable=False, default="")
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    # Written in batches, lags behind the actual use by up to API_TOKEN_LAST_USED_INTERVAL seconds
+    last_used_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "name": self.name,
+            "prefix": self.prefix,
+            "scopes": split_list(self.scopes),
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "last_used_at": self.last_used_at,
+        }
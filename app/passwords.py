@@ -0,0 +1,75 @@
+import threading
+from contextlib import contextmanager
+
+from app import bcrypt
+
+
+def _cooperative():
+    """True in a gunicorn gevent worker, where blocking calls that never yield stall every other request."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords with bcrypt without blocking the gevent hub.
+
+    bcrypt releases the GIL while it hashes, so in a gevent worker the work is handed to a native thread pool of
+    ``threads`` threads and only the greenlet of the login waits for it. At most ``login_concurrency`` logins
+    per worker hash at the same time, further attempts wait up to ``login_wait`` seconds for a slot.
+    Outside of gevent the hashing runs in the calling thread.
+    """
+
+    def __init__(self, threads=2, login_concurrency=4, login_wait=10.0):
+        self.threads = threads
+        self.login_concurrency = login_concurrency
+        self.login_wait = login_wait
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.threads = app.config.get('PASSWORD_HASH_THREADS', self.threads)
+        self.login_concurrency = app.config.get('LOGIN_CONCURRENCY', self.login_concurrency)
+        self.login_wait = app.config.get('LOGIN_QUEUE_TIMEOUT', self.login_wait)
+
+    def _run(self, func, *args):
+        if not self.threads or not _cooperative():
+            return func(*args)
+        if self._pool is None:
+            # Created in the worker after the fork, a pool created in the master would have no threads
+            from gevent.threadpool import ThreadPool
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.threads)
+        return self._pool.apply(func, args)
+
+    def hash(self, password):
+        return self._run(bcrypt.generate_password_hash, password).decode("utf-8")
+
+    def check(self, pw_hash, password):
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    @contextmanager
+    def login_slot(self):
+        """Yield True once one of the ``login_concurrency`` slots is taken, False if none freed up in time."""
+        if self._slots is None:
+            with self._lock:
+                if self._slots is None:
+                    if _cooperative():
+                        from gevent.lock import BoundedSemaphore
+                    else:
+                        from threading import BoundedSemaphore
+                    self._slots = BoundedSemaphore(self.login_concurrency)
+        if not self._slots.acquire(timeout=self.login_wait):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._slots.release()
+
+
+password_hasher = PasswordHasher()
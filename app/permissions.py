@@ -1,134 +1,169 @@
 from flask import current_app
-from app.models import Permission, Role, User
-from app import db
-from sqlalchemy.exc import IntegrityError
-
-def get_or_create(model, **kwargs):
-    """Get an instance if it exists, otherwise create and return an instance."""
-    instance = model.query.filter_by(**kwargs).first()
-    if instance:
-        return instance
-    else:
-        instance = model(**kwargs)
-        db.session.add(instance)
-        return instance
-
-def create_default_roles():
-    """Create default roles."""
-    role_names = ['admin', 'user', 'viewer']
-    roles = {}
-    for role_name in role_names:
-        roles[role_name] = get_or_create(Role, name=role_name)
-    return roles
-
-def create_permissions():
-    """Create permissions and assign them to roles."""
-    package_permissions = [
-        'view:package',
-        'add:package',
-        'edit:package',
-        'delete:package'
-    ]
-
-    version_permissions = [
-        'view:version',
-        'add:version',
-        'edit:version',
-        'delete:version'
-    ]
-
-    installer_permissions = [
-        'view:installer',
-        'add:installer',
-        'edit:installer',
-        'delete:installer'
-    ]
-
-    installer_switch_permissions = [
-        'view:installer_switch',
-        'add:installer_switch',
-        'edit:installer_switch',
-        'delete:installer_switch'
-    ]
-
-    role_permissions = [
-        'view:role',
-        'add:role',
-        'edit:role',
-        'delete:role',
-    ]
-
-    permission_permissions = [
-        'view:permission',
-        'add:permission',
-        'edit:permission',
-        'delete:permission',
-    ]
-
-    user_permissions = [
-        'view:user',
-        'add:user',
-        'edit:user',
-        'delete:user',
-    ]
+from sqlalchemy import insert, select, update
 
-    own_user_permissions = [
-        'view:own_user',
-        'edit:own_user',
-    ]
-
-    settings_permissions = [
-        'view:settings',
-        'edit:settings',
+from app.models import Permission, Role, User, roles_permissions
+from app import db
+from app.principals import principals
+
+package_permissions = [
+    'view:package',
+    'add:package',
+    'edit:package',
+    'delete:package'
+]
+
+version_permissions = [
+    'view:version',
+    'add:version',
+    'edit:version',
+    'delete:version'
+]
+
+installer_permissions = [
+    'view:installer',
+    'add:installer',
+    'edit:installer',
+    'delete:installer'
+]
+
+installer_switch_permissions = [
+    'view:installer_switch',
+    'add:installer_switch',
+    'edit:installer_switch',
+    'delete:installer_switch'
+]
+
+role_permissions = [
+    'view:role',
+    'add:role',
+    'edit:role',
+    'delete:role',
+]
+
+permission_permissions = [
+    'view:permission',
+    'add:permission',
+    'edit:permission',
+    'delete:permission',
+]
+
+user_permissions = [
+    'view:user',
+    'add:user',
+    'edit:user',
+    'delete:user',
+]
+
+own_user_permissions = [
+    'view:own_user',
+    'edit:own_user',
+]
+
+settings_permissions = [
+    'view:settings',
+    'edit:settings',
+]
+
+# Combine all permissions to one big list
+PERMISSIONS = (
+    package_permissions +
+    version_permissions +
+    installer_permissions +
+    installer_switch_permissions +
+    role_permissions +
+    permission_permissions +
+    user_permissions +
+    own_user_permissions +
+    settings_permissions
+)
+
+# Permissions every default role gets, roles can be given more in the webinterface and keep them
+DEFAULT_ROLES = {
+    'admin': PERMISSIONS,
+    'user': [
+        name for name in PERMISSIONS
+        if name not in ['add:role', 'edit:role', 'delete:role', 'add:permission', 'edit:permission',
+                        'delete:permission', 'add:user', 'edit:user', 'delete:user', 'edit:settings']
+    ],
+    'viewer': [
+        name for name in PERMISSIONS
+        if name.startswith('view:') and name not in ['view:role', 'view:permission', 'view:user']
+    ],
+}
+
+
+def seed_data():
+    """Everything reconcile() writes, fingerprinted by app.seed."""
+    return {'permissions': PERMISSIONS, 'roles': DEFAULT_ROLES}
+
+
+def reconcile():
+    """Create missing permissions and default roles and grant the default roles their permissions.
+
+    Runs a handful of bulk statements whatever the number of permissions. Grants are only added, permissions
+    taken away from a default role stay taken away until the seed data changes. Returns True if anything changed.
+    """
+    changed = False
+    permission_ids = dict(db.session.execute(select(Permission.name, Permission.id)).all())
+    missing = [{'name': name} for name in PERMISSIONS if name not in permission_ids]
+    if missing:
+        db.session.execute(insert(Permission), missing)
+        permission_ids = dict(db.session.execute(select(Permission.name, Permission.id)).all())
+        changed = True
+
+    role_ids = dict(db.session.execute(select(Role.name, Role.id)).all())
+    missing = [{'name': name} for name in DEFAULT_ROLES if name not in role_ids]
+    if missing:
+        db.session.execute(insert(Role), missing)
+        role_ids = dict(db.session.execute(select(Role.name, Role.id)).all())
+        changed = True
+
+    granted = set(db.session.execute(
+        select(roles_permissions.c.role_id, roles_permissions.c.permission_id)
+        .where(roles_permissions.c.role_id.in_([role_ids[name] for name in DEFAULT_ROLES]))
+    ).all())
+    grants = [
+        {'role_id': role_ids[role], 'permission_id': permission_ids[name]}
+        for role, names in DEFAULT_ROLES.items()
+        for name in names
+        if (role_ids[role], permission_ids[name]) not in granted
     ]
+    if grants:
+        db.session.execute(insert(roles_permissions), grants)
+        changed = True
+
+    if assign_user_roles():
+        changed = True
+    elif changed:
+        principals.invalidate()
+    return changed
+
+
+def assign_user_roles():
+    """Make the first user admin when no admin is left and give users without a role the viewer role.
+
+    Runs on every start, independent of the seed data, and costs two small SELECTs when there is nothing to repair.
+    Returns True if a user was changed.
+    """
+    admin_id = select(Role.id).where(Role.name == 'admin').scalar_subquery()
+    changed = False
+    if db.session.execute(select(User.id).where(User.role_id == admin_id).limit(1)).first() is None:
+        first_user = db.session.execute(select(User.id).order_by(User.id).limit(1)).scalar()
+        if first_user is not None:
+            db.session.execute(update(User).where(User.id == first_user).values(role_id=admin_id))
+            changed = True
+    if db.session.execute(select(User.id).where(User.role_id.is_(None)).limit(1)).first() is not None:
+        viewer_id = select(Role.id).where(Role.name == 'viewer').scalar_subquery()
+        db.session.execute(update(User).where(User.role_id.is_(None)).values(role_id=viewer_id))
+        changed = True
+
+    if changed:
+        principals.invalidate()
+    return changed
 
-    # Combine all permissions to one big list
-    permissions = (
-        package_permissions +
-        version_permissions +
-        installer_permissions +
-        installer_switch_permissions +
-        role_permissions +
-        permission_permissions +
-        user_permissions +
-        own_user_permissions +
-        settings_permissions
-    )
-    roles = create_default_roles()
-
-    for permission_name in permissions:
-        permission = get_or_create(Permission, name=permission_name)
-        
-        # Assign permissions to roles using your filtering logic:
-        if permission not in roles['admin'].permissions:
-            roles['admin'].permissions.append(permission)
-        
-        if permission_name not in ['add:role', 'edit:role', 'delete:role', 'add:permission', 'edit:permission', 'delete:permission', 'add:user', 'edit:user', 'delete:user', 'edit:settings'] and \
-           permission not in roles['user'].permissions:
-            roles['user'].permissions.append(permission)
-        
-        if permission_name.startswith('view:') and \
-           permission_name not in ['view:role', 'view:permission', 'view:user'] and \
-           permission not in roles['viewer'].permissions:
-            roles['viewer'].permissions.append(permission)
-
-    # Assign roles to users:
-    if not User.query.filter_by(role=roles['admin']).first():
-        first_user = User.query.first()
-        if first_user:
-            first_user.role = roles['admin']
-    
-    for user in User.query.filter_by(role=None):
-        user.role = roles['viewer']
 
 def create_all():
     """Entry function to create roles and permissions."""
     current_app.logger.info('Creating roles and permissions...')
-    try:
-        create_default_roles()
-        create_permissions()
-        db.session.commit()
-    except IntegrityError:
-        db.session.rollback()
-        current_app.logger.info('Roles and permissions already exist.')
-
+    reconcile()
+    db.session.commit()
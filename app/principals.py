@@ -0,0 +1,87 @@
+import time
+from collections import namedtuple
+
+from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
+
+from app.cache import VersionedCache
+from app.models import Role, User
+
+
+class RolePrincipal(namedtuple('RolePrincipal', ['id', 'name', 'permissions'])):
+    """The role of a Principal, ``permissions`` is a frozenset of permission names."""
+    __slots__ = ()
+
+    def has_permission(self, name):
+        return name in self.permissions
+
+
+class Principal(UserMixin):
+    """What a request needs to know about the logged in user, built from one query and cached per worker.
+
+    It stands in for the User model as ``current_user``, code that needs the model loads it by ``id``.
+    ``token_id`` is set when the request authenticated with an API token instead of a session.
+    """
+
+    def __init__(self, id, username, email, role, token_id=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.token_id = token_id
+
+    @classmethod
+    def from_user(cls, user, scopes=None, token_id=None):
+        """Build the principal of ``user``, limited to the permissions in ``scopes`` unless it is None."""
+        role = user.role
+        if role is None:
+            return cls(user.id, user.username, user.email, RolePrincipal(None, None, frozenset()), token_id)
+        permissions = frozenset(permission.name for permission in role.permissions)
+        if scopes is not None:
+            permissions &= frozenset(scopes)
+        return cls(user.id, user.username, user.email, RolePrincipal(role.id, role.name, permissions), token_id)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "username": self.username,
+            "email": self.email,
+            "role": self.role.name,
+            "permissions": sorted(self.role.permissions),
+        }
+
+
+class PrincipalCache(VersionedCache):
+    """Principals keyed by user id, dropped when the 'access' stamp moves and at the latest after ``ttl`` seconds.
+
+    Every write to users, roles, their permissions or API tokens has to call invalidate().
+    """
+
+    def __init__(self, ttl=300, maxsize=1024, check_interval=1.0):
+        super().__init__('access', maxsize, check_interval)
+        self.ttl = ttl
+
+    def init_app(self, app):
+        super().init_app(app, 'PRINCIPAL_CACHE_SIZE')
+        self.ttl = app.config.get('PRINCIPAL_CACHE_TTL', self.ttl)
+
+    def load(self, user_id):
+        """Return the Principal of ``user_id``, or None if there is no such user."""
+        entry = self.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+
+        user = (
+            User.query
+            .options(joinedload(User.role).joinedload(Role.permissions))
+            .filter_by(id=user_id)
+            .first()
+        )
+        if user is None:
+            return None
+        principal = Principal.from_user(user)
+        self.set(user_id, (principal, time.monotonic() + self.ttl))
+        return principal
+
+
+principals = PrincipalCache()
@@ -0,0 +1,225 @@
+import threading
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect, or_, select, text, update
+
+from app import db
+from app.cache import StampedCache
+from app.models import ChangeStamp, Package
+
+SEARCH_FIELDS = ('name', 'identifier', 'publisher')
+
+
+def trigrams(value):
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class LikeBackend:
+    """Plain ILIKE scan, used for keywords shorter than a trigram and when no index is available."""
+    name = 'like'
+
+    def condition(self, keyword, fields=SEARCH_FIELDS):
+        search = f'%{keyword}%'
+        return or_(*[getattr(Package, field).ilike(search) for field in fields])
+
+    def on_change(self, connection, package_id, values):
+        pass
+
+    def on_delete(self, connection, package_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SqliteFtsBackend(LikeBackend):
+    """SQLite FTS5 table with the trigram tokenizer, the rowid of each entry is the package id."""
+    name = 'sqlite'
+    table = 'package_search'
+
+    def condition(self, keyword, fields=SEARCH_FIELDS):
+        if len(keyword) < 3:
+            return super().condition(keyword, fields)
+        phrase = '"{}"'.format(keyword.replace('"', '""'))
+        match = '{%s} : %s' % (' '.join(fields), phrase)
+        ids = select(text('rowid')).select_from(text(self.table)).where(
+            text(f'{self.table} MATCH :match').bindparams(match=match)
+        )
+        return Package.id.in_(ids)
+
+    def on_change(self, connection, package_id, values):
+        self.on_delete(connection, package_id)
+        connection.execute(
+            text(f'INSERT INTO {self.table} (rowid, name, identifier, publisher) '
+                 'VALUES (:id, :name, :identifier, :publisher)'),
+            dict(values, id=package_id),
+        )
+
+    def on_delete(self, connection, package_id):
+        connection.execute(text(f'DELETE FROM {self.table} WHERE rowid = :id'), {'id': package_id})
+
+    def rebuild(self):
+        db.session.execute(text(f'DELETE FROM {self.table}'))
+        db.session.execute(text(
+            f'INSERT INTO {self.table} (rowid, name, identifier, publisher) '
+            'SELECT id, name, identifier, publisher FROM package'
+        ))
+        db.session.commit()
+
+
+class PostgresTrgmBackend(LikeBackend):
+    """pg_trgm GIN indexes let PostgreSQL answer ILIKE '%kw%' from the index, so only the indexes need upkeep."""
+    name = 'postgresql'
+
+    def rebuild(self):
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for field in SEARCH_FIELDS:
+            index = f'ix_package_{field}_trgm'
+            db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {index} ON package USING gin ({field} gin_trgm_ops)'))
+            db.session.execute(text(f'REINDEX INDEX {index}'))
+        db.session.commit()
+
+
+class MemoryNgramBackend(StampedCache, LikeBackend):
+    """In-process trigram inverted index for databases without a usable substring index (MySQL).
+
+    Writes bump the 'search' change stamp, every worker rebuilds its copy when it sees the stamp move.
+    """
+    name = 'memory'
+
+    def __init__(self, check_interval=1.0):
+        super().__init__('search', check_interval)
+        self._postings = None
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._postings = None
+
+    def _load(self):
+        postings = defaultdict(set)
+        documents = {}
+        rows = db.session.execute(select(Package.id, Package.name, Package.identifier, Package.publisher))
+        for row in rows:
+            documents[row.id] = {field: (getattr(row, field) or '').lower() for field in SEARCH_FIELDS}
+            for value in documents[row.id].values():
+                for gram in trigrams(value):
+                    postings[gram].add(row.id)
+        with self._lock:
+            self._postings = dict(postings)
+            self._documents = documents
+
+    def condition(self, keyword, fields=SEARCH_FIELDS):
+        if len(keyword) < 3:
+            return super().condition(keyword, fields)
+        self._sync()
+        if self._postings is None:
+            self._load()
+        keyword = keyword.lower()
+        with self._lock:
+            postings = self._postings or {}
+            candidates = None
+            for gram in trigrams(keyword):
+                posting = postings.get(gram, set())
+                candidates = posting if candidates is None else candidates & posting
+                if not candidates:
+                    break
+            # Trigrams only narrow the candidates down, confirm the actual substring match
+            ids = [package_id for package_id in candidates or ()
+                   if any(keyword in self._documents[package_id][field] for field in fields)]
+        return Package.id.in_(ids)
+
+    def _bump(self, connection):
+        # Runs inside a flush, so the stamp is bumped on the flushing connection rather than through the session
+        connection.execute(
+            update(ChangeStamp).where(ChangeStamp.name == self.stamp).values(value=ChangeStamp.value + 1)
+        )
+        self.clear()
+        self._version = None
+
+    def on_change(self, connection, package_id, values):
+        self._bump(connection)
+
+    def on_delete(self, connection, package_id):
+        self._bump(connection)
+
+    def rebuild(self):
+        self._load()
+
+
+class SearchIndex:
+    """Picks the substring search backend for the configured database and keeps it in sync with Package writes."""
+
+    def __init__(self):
+        self._backend = None
+
+    def init_app(self, app):
+        self._backend = None
+        app.cli.add_command(search_cli)
+
+    @property
+    def backend(self):
+        return self.get_backend(db.session.connection())
+
+    def get_backend(self, connection):
+        if self._backend is None:
+            self._backend = self._select_backend(connection)
+            current_app.logger.info(f"Using {self._backend.name} package search backend")
+        return self._backend
+
+    def _select_backend(self, connection):
+        choice = current_app.config.get('SEARCH_BACKEND', 'auto')
+        if choice == 'auto':
+            choice = {'sqlite': 'sqlite', 'postgresql': 'postgresql'}.get(connection.dialect.name, 'memory')
+        if choice == 'sqlite':
+            # The FTS5 table is created by a migration, fall back to LIKE if this SQLite build couldn't create it
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': SqliteFtsBackend.table},
+            ).first()
+            return SqliteFtsBackend() if exists else LikeBackend()
+        if choice == 'postgresql':
+            return PostgresTrgmBackend()
+        if choice == 'memory':
+            return MemoryNgramBackend(current_app.config.get('CACHE_STAMP_INTERVAL', 1.0))
+        return LikeBackend()
+
+    def condition(self, keyword, fields=SEARCH_FIELDS):
+        """SQL condition matching packages where any of ``fields`` contains ``keyword``, case-insensitively."""
+        return self.backend.condition(keyword, fields)
+
+    def rebuild(self):
+        self.backend.rebuild()
+
+
+search_index = SearchIndex()
+
+
+@event.listens_for(Package, 'after_insert')
+@event.listens_for(Package, 'after_update')
+def _index_package(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[field].history.has_changes() for field in SEARCH_FIELDS):
+        return
+    values = {field: getattr(target, field) for field in SEARCH_FIELDS}
+    search_index.get_backend(connection).on_change(connection, target.id, values)
+
+
+@event.listens_for(Package, 'after_delete')
+def _unindex_package(mapper, connection, target):
+    search_index.get_backend(connection).on_delete(connection, target.id)
+
+
+search_cli = AppGroup('search', help='Manage the package search index.')
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild the package search index from the package table."""
+    search_index.rebuild()
+    click.echo(f"Rebuilt {search_index.backend.name} search index.")
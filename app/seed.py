@@ -0,0 +1,64 @@
+import hashlib
+import json
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import SeedState
+from app.permissions import assign_user_roles, reconcile as reconcile_permissions, seed_data as permission_seed_data
+from app.settings import reconcile as reconcile_settings, seed_data as setting_seed_data
+
+SEED_NAME = 'bootstrap'
+
+
+def fingerprint():
+    """SHA256 of the roles, permissions and settings the app seeds, changes whenever the seed data does."""
+    data = {**permission_seed_data(), **setting_seed_data()}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def bootstrap():
+    """Bring the seeded roles, permissions and settings up to date, run by every worker when it starts.
+
+    A worker whose seed data matches the stored fingerprint only runs one SELECT and the two of assign_user_roles().
+    Otherwise the first worker to lock the fingerprint row reconciles in bulk and stores the new fingerprint, workers
+    waiting on the lock find it up to date once they get it.
+    """
+    expected = fingerprint()
+    current = db.session.execute(select(SeedState.fingerprint).where(SeedState.name == SEED_NAME)).scalar()
+    if current == expected:
+        # Users can lose their role in the webinterface at any time, not only when the seed data changes
+        if assign_user_roles():
+            db.session.commit()
+        else:
+            db.session.rollback()
+        return False
+    db.session.rollback()
+
+    if current is None:
+        # First start on this database, a worker starting at the same time may create the row first
+        db.session.add(SeedState(name=SEED_NAME, fingerprint=''))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+    # The UPDATE takes the row lock, or the database write lock on SQLite, until the commit
+    db.session.execute(
+        update(SeedState).where(SeedState.name == SEED_NAME).values(fingerprint=SeedState.fingerprint)
+    )
+    current = db.session.execute(
+        select(SeedState.fingerprint).where(SeedState.name == SEED_NAME).with_for_update()
+    ).scalar()
+    if current == expected:
+        db.session.commit()
+        return False
+
+    current_app.logger.info('Seed data changed, reconciling roles, permissions and settings...')
+    reconcile_permissions()
+    reconcile_settings()
+    db.session.execute(update(SeedState).where(SeedState.name == SEED_NAME).values(fingerprint=expected))
+    db.session.commit()
+    return True
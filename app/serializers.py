@@ -0,0 +1,138 @@
+import json
+from json.encoder import encode_basestring_ascii
+from urllib.parse import quote
+
+from flask import url_for
+
+from app.models import split_list
+
+# Characters werkzeug leaves unquoted in a path segment when it builds an URL
+URL_SAFE = "!$&'()*+,/:;=@"
+_PLACEHOLDERS = ('__identifier__', '__version__', '__architecture__', '__scope__')
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def _json(value):
+    # Nearly every value is a string, escaped by the C accelerated encoder the json module itself uses
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    return 'null' if value is None else _encode(value)
+
+
+def _json_list(values):
+    return '[' + ','.join(map(_json, values)) + ']'
+
+
+def download_url_template():
+    """The absolute download URL with ``{0}`` to ``{3}`` in place of identifier, version, architecture and scope.
+
+    Built with one url_for call per response instead of one per installer.
+    """
+    url = url_for(
+        'api.download',
+        **dict(zip(('identifier', 'version', 'architecture', 'scope'), _PLACEHOLDERS)),
+        _external=True,
+        _scheme='https',
+    )
+    template = url.replace('{', '{{').replace('}', '}}')
+    for index, placeholder in enumerate(_PLACEHOLDERS):
+        template = template.replace(placeholder, '{%d}' % index)
+    return template
+
+
+def _quote(value):
+    return quote(str(value), safe=URL_SAFE)
+
+
+def _installer_entries(installer, quoted_identifier, quoted_version, url_template):
+    url = url_template.format(quoted_identifier, quoted_version, _quote(installer.architecture), _quote(installer.scope))
+    head = (
+        '{"Architecture":' + _json(installer.architecture)
+        + ',"InstallerType":' + _json(installer.installer_type)
+        + ',"InstallerUrl":' + _json(url)
+        + ',"InstallerSha256":' + _json(installer.installer_sha256)
+        + ',"Scope":'
+    )
+    tail = [
+        ',"InstallerSwitches":{',
+        ','.join(_json(switch.parameter) + ':' + _json(switch.value) for switch in installer.switches),
+        '}',
+    ]
+    if installer.installer_type == 'zip':
+        tail += [
+            ',"NestedInstallerType":', _json(installer.nested_installer_type),
+            ',"NestedInstallerFiles":[',
+            ','.join(
+                '{"RelativeFilePath":' + _json(nested.relative_file_path)
+                + ',"PortableCommandAlias":' + _json(nested.portable_command_alias) + '}'
+                for nested in installer.nested_installer_files
+            ),
+            ']',
+        ]
+    if installer.product_code:
+        tail += [',"ProductCode":', _json(installer.product_code)]
+    if installer.package_family_name:
+        tail += [',"PackageFamilyName":', _json(installer.package_family_name)]
+    if installer.upgrade_code:
+        tail += [',"AppsAndFeaturesEntries":[{"UpgradeCode":', _json(installer.upgrade_code), '}]']
+    if installer.commands:
+        tail += [',"Commands":', _json_list(split_list(installer.commands))]
+    tail.append('}')
+    tail = ''.join(tail)
+
+    if installer.scope == 'both':
+        # One entry per scope, both download the same installer
+        return [head + '"user"' + tail, head + '"machine"' + tail]
+    return [head + _json(installer.scope) + tail]
+
+
+def package_manifest(package):
+    """JSON bytes of the packageManifests response for ``package``, the same document Package.generate_output() builds.
+
+    Versions without installers are left out.
+    """
+    url_template = download_url_template()
+    # Everything in DefaultLocale except the locale and the description is the same for every version
+    locale_package = ',"Publisher":' + _json(package.publisher) + ',"PackageName":' + _json(package.name)
+    locale_extras = ''
+    if package.moniker:
+        locale_extras += ',"Moniker":' + _json(package.moniker)
+    if package.tags:
+        locale_extras += ',"Tags":' + _json_list(split_list(package.tags))
+
+    quoted_identifier = _quote(package.identifier)
+    versions = []
+    for version in package.versions:
+        quoted_version = _quote(version.version_code)
+        installers = [
+            entry
+            for installer in version.installers
+            for entry in _installer_entries(installer, quoted_identifier, quoted_version, url_template)
+        ]
+        if not installers:
+            continue
+        versions.append(
+            '{"PackageVersion":' + _json(version.version_code)
+            + ',"DefaultLocale":{"PackageLocale":' + _json(version.package_locale) + locale_package
+            + ',"ShortDescription":' + _json(version.short_description) + locale_extras
+            + '},"Installers":[' + ','.join(installers) + ']}'
+        )
+    return (
+        '{"Data":{"PackageIdentifier":' + _json(package.identifier) + ',"Versions":[' + ','.join(versions) + ']}}'
+    ).encode()
+
+
+def manifest_search(packages, continuation_token=None):
+    """JSON bytes of a manifestSearch response, each package as Package.generate_output_manifest_search() builds it."""
+    data = ','.join(
+        '{"PackageIdentifier":' + _json(package.identifier)
+        + ',"PackageName":' + _json(package.name)
+        + ',"Publisher":' + _json(package.publisher)
+        + ',"Versions":[' + ','.join('{"PackageVersion":' + _json(version.version_code) + '}'
+                                    for version in package.versions) + ']}'
+        for package in packages
+    )
+    body = '{"Data":[' + data + ']'
+    if continuation_token is not None:
+        body += ',"ContinuationToken":' + _json(continuation_token)
+    return (body + '}').encode()
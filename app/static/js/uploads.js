@@ -0,0 +1,82 @@
+// Direct to S3 uploads, shared by the add package, add version and add installer modals
+
+const MULTIPART_THRESHOLD = 64 * 1024 * 1024;
+const MULTIPART_CONCURRENCY = 4;
+const MULTIPART_URL_BATCH = 20;
+const MULTIPART_PART_ATTEMPTS = 5;
+
+async function sha256Base64(file) {
+    // Hashing needs the whole file in memory, larger files are hashed on the server instead
+    if (!window.crypto || !window.crypto.subtle || file.size > 512 * 1024 * 1024) {
+        return null;
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return btoa(String.fromCharCode(...new Uint8Array(digest)));
+}
+
+async function multipartUpload(createUrl, formData, file, onProgress) {
+    formData.append('size', file.size);
+    const upload = (await axios.post(createUrl, formData)).data;
+    const urls = {};
+    const loaded = {};
+    let nextPart = 1;
+
+    const presign = async (partNumber) => {
+        // Part URLs are signed in batches, starting with the part that needs one
+        const partNumbers = [];
+        for (let number = partNumber; number <= upload.part_count && partNumbers.length < MULTIPART_URL_BATCH; number++) {
+            if (!urls[number]) {
+                partNumbers.push(number);
+            }
+        }
+        const response = await axios.post(upload.parts_url, { part_numbers: partNumbers });
+        Object.assign(urls, response.data.urls);
+    };
+
+    const reportProgress = () => {
+        const sent = Object.values(loaded).reduce((sum, bytes) => sum + bytes, 0);
+        onProgress(Math.round((sent / file.size) * 100));
+    };
+
+    const uploadPart = async (partNumber) => {
+        const start = (partNumber - 1) * upload.part_size;
+        const part = file.slice(start, Math.min(start + upload.part_size, file.size));
+        for (let attempt = 1; ; attempt++) {
+            try {
+                if (!urls[partNumber]) {
+                    await presign(partNumber);
+                }
+                await axios.put(urls[partNumber], part, {
+                    onUploadProgress: progressEvent => {
+                        loaded[partNumber] = progressEvent.loaded;
+                        reportProgress();
+                    }
+                });
+                loaded[partNumber] = part.size;
+                return;
+            } catch (error) {
+                loaded[partNumber] = 0;
+                if (attempt >= MULTIPART_PART_ATTEMPTS) {
+                    throw error;
+                }
+                // Only the failed part is sent again, with a fresh URL in case the old one expired meanwhile
+                delete urls[partNumber];
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+            }
+        }
+    };
+
+    const worker = async () => {
+        while (nextPart <= upload.part_count) {
+            await uploadPart(nextPart++);
+        }
+    };
+
+    try {
+        await Promise.all(Array.from({ length: Math.min(MULTIPART_CONCURRENCY, upload.part_count) }, worker));
+        return (await axios.post(upload.complete_url)).data;
+    } catch (error) {
+        axios.delete(upload.abort_url).catch(() => {});
+        throw error;
+    }
+}
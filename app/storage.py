@@ -0,0 +1,560 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import after_this_request, current_app, g, has_request_context
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_, select, update
+
+from app import db
+from app.cache import manifest_cache, settings_snapshot
+from app.models import Installer, MultipartUpload, Package, PackageVersion, StorageDeletion
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+_s3_client = None
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        from botocore.config import Config
+        # SigV4 signs the checksum headers of presigned uploads, S3_ENDPOINT_URL points at a local S3 stand-in
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url=current_app.config.get('S3_ENDPOINT_URL') or None,
+            config=Config(signature_version='s3v4'),
+        )
+    return _s3_client
+
+
+class PresignedUrlCache:
+    """TTL cache of presigned S3 GET URLs keyed by bucket, object key and content disposition.
+
+    Signing is pure CPU work, so an URL is reused until ``safety_margin`` seconds before it expires, which leaves
+    clients enough time to start the transfer with it.
+    """
+
+    def __init__(self, expires_in=3600, safety_margin=300, maxsize=4096):
+        self.expires_in = expires_in
+        self.safety_margin = safety_margin
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.expires_in = app.config.get('PRESIGNED_URL_EXPIRATION', self.expires_in)
+        self.safety_margin = app.config.get('PRESIGNED_URL_SAFETY_MARGIN', self.safety_margin)
+        self.maxsize = app.config.get('PRESIGNED_URL_CACHE_SIZE', self.maxsize)
+
+    def get(self, client, bucket, key, disposition=None):
+        cache_key = (bucket, key, disposition)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                self._entries.move_to_end(cache_key)
+                return entry[0]
+            self.misses += 1
+
+        params = {'Bucket': bucket, 'Key': key}
+        if disposition:
+            params['ResponseContentDisposition'] = disposition
+            params['ResponseContentType'] = 'application/octet-stream'
+        url = client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.expires_in)
+
+        refresh_at = now + max(self.expires_in - self.safety_margin, 0)
+        with self._lock:
+            self._entries[cache_key] = (url, refresh_at)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return url
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class BlobStore:
+    """Content-addressed installer storage, every distinct file is kept once under ``blobs/ab/cd/<sha256>``.
+
+    Keys are relative to the ``packages`` directory locally and to the ``packages/`` prefix in S3. An installer
+    references its blob through ``Installer.storage_key``, a blob is deleted once no installer references it anymore.
+    """
+    root = 'packages'
+
+    def init_app(self, app):
+        from app.storage_gc import gc_command
+        storage_cli.add_command(gc_command)
+        app.cli.add_command(storage_cli)
+
+    @staticmethod
+    def key_for(sha256):
+        sha256 = sha256.lower()
+        return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+    @property
+    def staging_directory(self):
+        return os.path.join(basedir, self.root, '.staging')
+
+    def local_path(self, key):
+        return os.path.join(basedir, self.root, *key.split('/'))
+
+    def object_key(self, key):
+        return f'{self.root}/{key}'
+
+    def store_local(self, source_path, sha256):
+        """Move a hashed file into the store, the file is dropped if an identical blob is already stored."""
+        key = self.key_for(sha256)
+        storage_deletions.cancel(key)
+        path = self.local_path(key)
+        if os.path.exists(path):
+            current_app.logger.info(f"Blob {key} already stored, deduplicating upload")
+            os.remove(source_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(source_path, path)
+        return key
+
+    def store_s3(self, source_key, sha256, delete_source=True):
+        """Move an uploaded S3 object into the store, the object is dropped if an identical blob is already stored."""
+        from botocore.exceptions import ClientError
+
+        client = get_s3_client()
+        bucket = settings_snapshot.get("BUCKET_NAME")
+        key = self.key_for(sha256)
+        storage_deletions.cancel(key)
+        try:
+            client.head_object(Bucket=bucket, Key=self.object_key(key))
+            current_app.logger.info(f"Blob {key} already stored, deduplicating upload")
+        except ClientError as error:
+            if error.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            # Managed copy, switches to a multipart copy for objects above the 5 GB CopyObject limit
+            client.copy({'Bucket': bucket, 'Key': source_key}, bucket, self.object_key(key))
+        if delete_source:
+            client.delete_object(Bucket=bucket, Key=source_key)
+        return key
+
+    @staticmethod
+    def references(key):
+        # Installers detached from their version by older releases of WinGetty don't hold a reference
+        return Installer.query.filter(Installer.storage_key == key, Installer.version_id.isnot(None)).count()
+
+    def release(self, keys):
+        """Queue the blobs of ``keys`` for deletion, committed with the caller's session.
+
+        Blobs can be shared, a blob some installer references again by the time the deletion runs is kept.
+        """
+        for key in set(filter(None, keys)):
+            storage_deletions.enqueue(self.object_key(key), storage_key=key)
+
+
+class StorageDeletionQueue:
+    """Database backed queue of StorageDeletions, worked off in batches by one thread in every worker process.
+
+    Deleting installers only removes their database rows and queues their files, the thread then removes up to
+    ``batch_size`` files at once, with one DeleteObjects request per bucket or with parallel unlinks. Failed
+    deletions are retried with exponential backoff until ``max_attempts``.
+    """
+    # S3 accepts at most 1000 keys per DeleteObjects request
+    max_batch_size = 1000
+    local_concurrency = 8
+
+    def __init__(self, batch_size=1000, sqlite_batch_size=100, poll_interval=30.0, lease=300, max_attempts=5):
+        self.app = None
+        self.batch_size = batch_size
+        self.sqlite_batch_size = sqlite_batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = min(app.config.get('STORAGE_DELETION_BATCH_SIZE', self.batch_size), self.max_batch_size)
+        self.sqlite_batch_size = app.config.get('STORAGE_DELETION_SQLITE_BATCH_SIZE', self.sqlite_batch_size)
+        self.poll_interval = app.config.get('STORAGE_DELETION_POLL_INTERVAL', self.poll_interval)
+        self.max_attempts = app.config.get('STORAGE_DELETION_MAX_ATTEMPTS', self.max_attempts)
+        app.before_request(self.start)
+
+    def start(self):
+        # Started on the first request so the thread is created after gunicorn forked the worker
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='storage-deletion', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, path, storage_key=None):
+        """Queue the file at ``path`` for deletion, committed with the caller's session."""
+        bucket = settings_snapshot.get("BUCKET_NAME") if settings_snapshot.get("USE_S3") else None
+        db.session.add(StorageDeletion(bucket=bucket, path=path, storage_key=storage_key))
+        if has_request_context() and not g.get('storage_deletions_queued'):
+            g.storage_deletions_queued = True
+
+            @after_this_request
+            def wake_worker(response):
+                self._wake.set()
+                return response
+
+    @staticmethod
+    def cancel(storage_key):
+        """Drop queued deletions of a blob that is stored again, committed with the caller's session.
+
+        Waits for a deletion of the blob that is running, callers check whether the blob exists only afterwards.
+        """
+        StorageDeletion.query.filter_by(storage_key=storage_key).delete(synchronize_session=False)
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    ran = self.run_next()
+            except Exception as error:
+                self.app.logger.error(f"Storage deletion worker failed: {error}")
+                ran = 0
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim(self):
+        batch_size = self.batch_size
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # The whole database stays locked while a batch is deleted, see _lock_rows()
+            batch_size = min(batch_size, self.sqlite_batch_size)
+        now = datetime.utcnow()
+        claimable = and_(
+            StorageDeletion.status == 'pending',
+            StorageDeletion.run_after <= now,
+            or_(StorageDeletion.locked_until.is_(None), StorageDeletion.locked_until < now),
+        )
+        while True:
+            ids = db.session.execute(
+                select(StorageDeletion.id).where(claimable).order_by(StorageDeletion.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                db.session.rollback()
+                return []
+            token = uuid.uuid4().hex
+            db.session.execute(
+                update(StorageDeletion)
+                .where(StorageDeletion.id.in_(ids), claimable)
+                .values(
+                    claimed_by=token,
+                    attempts=StorageDeletion.attempts + 1,
+                    locked_until=now + timedelta(seconds=self.lease),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            # Rows another worker claimed in between are simply left to it
+            deletions = StorageDeletion.query.filter_by(claimed_by=token).all()
+            if deletions:
+                return deletions
+
+    def run_next(self):
+        """Claim and run the next batch of due deletions, returns the number of deletions claimed."""
+        claimed = self._claim()
+        if not claimed:
+            return 0
+        deletions = self._lock_rows(claimed)
+
+        # Checked under the locks, an installer created before a cancelled deletion committed is seen here
+        blob_keys = {deletion.storage_key for deletion in deletions if deletion.storage_key}
+        referenced = set()
+        if blob_keys:
+            referenced = set(db.session.execute(
+                select(Installer.storage_key)
+                .where(Installer.storage_key.in_(blob_keys), Installer.version_id.isnot(None))
+                .distinct()
+            ).scalars())
+
+        by_bucket = defaultdict(list)
+        for deletion in deletions:
+            if deletion.storage_key not in referenced:
+                by_bucket[deletion.bucket].append(deletion)
+        errors = {}
+        for bucket, group in by_bucket.items():
+            paths = {deletion.path for deletion in group}
+            failed = self._delete_local(paths) if bucket is None else self._delete_s3(bucket, paths)
+            errors.update((deletion.id, failed[deletion.path]) for deletion in group if deletion.path in failed)
+
+        for deletion in deletions:
+            if deletion.id in errors:
+                self._retry_or_fail(deletion, errors[deletion.id])
+        done = [deletion.id for deletion in deletions if deletion.id not in errors]
+        StorageDeletion.query.filter(StorageDeletion.id.in_(done)).delete(synchronize_session=False)
+        db.session.commit()
+        self.app.logger.info(f"Deleted {len(done)} stored files, {len(errors)} deletions failed")
+        return len(claimed)
+
+    def _lock_rows(self, deletions):
+        """Lock the rows of the claimed ``deletions`` until the next commit, returns the ones not cancelled meanwhile.
+
+        A request storing a blob again cancels its deletion and only drops the upload if the blob still exists
+        afterwards. The locks make cancel() wait while the files are deleted, so the request finds them gone and
+        stores its upload. A deletion a request cancelled first is skipped once that request committed.
+
+        On SQLite this is the database write lock, every other write waits until the batch is deleted. _claim() keeps
+        batches to ``sqlite_batch_size`` there.
+        """
+        mine = and_(StorageDeletion.id.in_([deletion.id for deletion in deletions]),
+                    StorageDeletion.claimed_by == deletions[0].claimed_by)
+        # The UPDATE takes the row locks, or the database write lock on SQLite
+        db.session.execute(
+            update(StorageDeletion)
+            .where(mine)
+            .values(locked_until=datetime.utcnow() + timedelta(seconds=self.lease))
+            .execution_options(synchronize_session=False)
+        )
+        owned = set(db.session.execute(select(StorageDeletion.id).where(mine).with_for_update()).scalars())
+        return [deletion for deletion in deletions if deletion.id in owned]
+
+    @staticmethod
+    def _delete_s3(bucket, paths):
+        """Delete ``paths`` from ``bucket`` in one request, returns the error of every path that wasn't deleted."""
+        try:
+            response = get_s3_client().delete_objects(
+                Bucket=bucket, Delete={'Objects': [{'Key': path} for path in paths], 'Quiet': True}
+            )
+        except Exception as error:
+            return {path: str(error) for path in paths}
+        return {error['Key']: f"{error.get('Code')}: {error.get('Message')}" for error in response.get('Errors', [])}
+
+    def _delete_local(self, paths):
+        """Unlink ``paths`` in parallel, returns the error of every path that wasn't deleted."""
+        def unlink(path):
+            try:
+                os.remove(os.path.join(basedir, *path.split('/')))
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                return path, str(error)
+            return path, None
+
+        with ThreadPoolExecutor(max_workers=self.local_concurrency) as executor:
+            return {path: error for path, error in executor.map(unlink, paths) if error}
+
+    def _retry_or_fail(self, deletion, error):
+        self.app.logger.warning(f"Deleting {deletion.path} failed (attempt {deletion.attempts}): {error}")
+        deletion.last_error = error[:500]
+        deletion.locked_until = None
+        if deletion.attempts >= self.max_attempts:
+            deletion.status = 'failed'
+        else:
+            deletion.run_after = datetime.utcnow() + timedelta(seconds=min(30 * 2 ** (deletion.attempts - 1), 3600))
+
+
+class MultipartUploads:
+    """Browser uploads to S3 in parts, each part is sent to its own presigned upload_part URL."""
+    min_part_size = 8 * 1024 * 1024
+    max_parts = 10000
+    max_size = 5 * 1024 ** 4
+
+    def __init__(self, max_age=24, url_expiration=3600):
+        self.max_age = max_age
+        self.url_expiration = url_expiration
+
+    def init_app(self, app):
+        self.max_age = app.config.get('MULTIPART_UPLOAD_MAX_AGE', self.max_age)
+        self.url_expiration = app.config.get('PRESIGNED_URL_EXPIRATION', self.url_expiration)
+
+    def part_size_for(self, size):
+        # Whole MiB parts, large enough to stay within S3's part count limit
+        part_size = max(self.min_part_size, -(-size // self.max_parts))
+        return -(-part_size // (1024 * 1024)) * 1024 * 1024
+
+    def create(self, user_id, object_key, file_name, content_type, size):
+        response = get_s3_client().create_multipart_upload(
+            Bucket=settings_snapshot.get("BUCKET_NAME"), Key=object_key, ContentType=content_type
+        )
+        upload = MultipartUpload(
+            user_id=user_id,
+            upload_id=response['UploadId'],
+            object_key=object_key,
+            file_name=file_name,
+            size=size,
+            part_size=self.part_size_for(size),
+        )
+        db.session.add(upload)
+        return upload
+
+    def presign_parts(self, upload, part_numbers):
+        client = get_s3_client()
+        bucket = settings_snapshot.get("BUCKET_NAME")
+        return {
+            part_number: client.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': bucket, 'Key': upload.object_key, 'UploadId': upload.upload_id,
+                        'PartNumber': part_number},
+                ExpiresIn=self.url_expiration,
+            )
+            for part_number in part_numbers
+        }
+
+    def uploaded_parts(self, upload):
+        """The parts S3 received so far, listed by the server so clients don't need to read ETag headers."""
+        paginator = get_s3_client().get_paginator('list_parts')
+        pages = paginator.paginate(
+            Bucket=settings_snapshot.get("BUCKET_NAME"), Key=upload.object_key, UploadId=upload.upload_id
+        )
+        return [
+            {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+            for page in pages for part in page.get('Parts', [])
+        ]
+
+    def complete(self, upload, parts):
+        get_s3_client().complete_multipart_upload(
+            Bucket=settings_snapshot.get("BUCKET_NAME"),
+            Key=upload.object_key,
+            UploadId=upload.upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in parts]},
+        )
+        upload.status = 'completed'
+
+    def abort(self, upload):
+        from botocore.exceptions import ClientError
+
+        try:
+            get_s3_client().abort_multipart_upload(
+                Bucket=settings_snapshot.get("BUCKET_NAME"), Key=upload.object_key, UploadId=upload.upload_id
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+        upload.status = 'aborted'
+
+    def abort_stale(self, limit=None):
+        """Abort active uploads older than ``max_age`` hours and forget finished ones, returns the aborted count."""
+        cutoff = datetime.utcnow() - timedelta(hours=self.max_age)
+        query = MultipartUpload.query.filter(
+            MultipartUpload.status == 'active', MultipartUpload.created_at < cutoff
+        ).order_by(MultipartUpload.id)
+        stale = query.limit(limit).all() if limit else query.all()
+        for upload in stale:
+            current_app.logger.info(f"Aborting abandoned multipart upload of {upload.object_key}")
+            self.abort(upload)
+        MultipartUpload.query.filter(
+            MultipartUpload.status != 'active', MultipartUpload.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return len(stale)
+
+
+presigned_urls = PresignedUrlCache()
+blob_store = BlobStore()
+storage_deletions = StorageDeletionQueue()
+multipart_uploads = MultipartUploads()
+storage_cli = AppGroup('storage', help='Manage installer storage.')
+
+
+@storage_cli.command('migrate')
+@click.option('--batch-size', default=100, show_default=True, help='Installers committed per batch.')
+def migrate_command(batch_size):
+    """Move installers stored under per-publisher paths into the content-addressed blob store."""
+    from app.utils import calculate_sha256
+
+    use_s3 = settings_snapshot.get("USE_S3")
+    migrated = missing = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(Installer, Package.publisher, Package.identifier, PackageVersion.version_code)
+            .join(PackageVersion, Installer.version_id == PackageVersion.id)
+            .join(Package, Package.identifier == PackageVersion.identifier)
+            .filter(
+                Installer.id > last_id,
+                Installer.storage_key.is_(None),
+                Installer.external_url.is_(None),
+                Installer.file_name.isnot(None),
+                # Their hash job reads the uploaded object and moves it into the store itself
+                Installer.hash_pending.is_(False),
+            )
+            .order_by(Installer.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+
+        legacy_objects = []
+        for installer, publisher, identifier, version_code in rows:
+            legacy_key = '/'.join([blob_store.root, publisher, identifier, version_code, installer.architecture,
+                                   installer.file_name])
+            if use_s3:
+                # The recorded hash was computed from this very object when it was uploaded
+                installer.storage_key = blob_store.store_s3(legacy_key, installer.installer_sha256, delete_source=False)
+                legacy_objects.append(legacy_key)
+            else:
+                legacy_path = os.path.join(basedir, *legacy_key.split('/'))
+                if not os.path.isfile(legacy_path):
+                    click.echo(f"Missing file for installer {installer.id}: {legacy_key}", err=True)
+                    missing += 1
+                    continue
+                sha256 = calculate_sha256(legacy_path)
+                if sha256 != installer.installer_sha256.lower():
+                    click.echo(f"Hash of installer {installer.id} changed, updating it: {legacy_key}", err=True)
+                    installer.installer_sha256 = sha256
+                # Copied rather than moved so the old tree stays intact until the batch is committed
+                shutil.copyfile(legacy_path, legacy_path + '.blob')
+                installer.storage_key = blob_store.store_local(legacy_path + '.blob', sha256)
+                legacy_objects.append(legacy_path)
+            migrated += 1
+
+        manifest_cache.invalidate()
+        db.session.commit()
+        for legacy_object in legacy_objects:
+            if use_s3:
+                get_s3_client().delete_object(Bucket=settings_snapshot.get("BUCKET_NAME"), Key=legacy_object)
+            else:
+                os.remove(legacy_object)
+
+    if not use_s3:
+        # Drop the per-publisher directories the migration emptied
+        root = os.path.join(basedir, blob_store.root)
+        for entry in os.listdir(root) if os.path.isdir(root) else ():
+            if entry in ('blobs', '.staging') or not os.path.isdir(os.path.join(root, entry)):
+                continue
+            for directory, _, _ in os.walk(os.path.join(root, entry), topdown=False):
+                if not os.listdir(directory):
+                    os.rmdir(directory)
+
+    click.echo(f"Migrated {migrated} installers to the blob store, {missing} files missing.")
+
+
+@storage_cli.command('abort-uploads')
+def abort_uploads_command():
+    """Abort multipart uploads abandoned for longer than MULTIPART_UPLOAD_MAX_AGE hours."""
+    count = multipart_uploads.abort_stale()
+    click.echo(f"Aborted {count} abandoned multipart uploads.")
+
+
+@storage_cli.command('delete')
+@click.option('--retry-failed', is_flag=True, help='Queue deletions that used up their attempts again first.')
+def delete_command(retry_failed):
+    """Work off every due storage deletion in the foreground."""
+    if retry_failed:
+        StorageDeletion.query.filter_by(status='failed').update(
+            {StorageDeletion.status: 'pending', StorageDeletion.attempts: 0, StorageDeletion.run_after: datetime.utcnow()}
+        )
+        db.session.commit()
+    count = 0
+    while ran := storage_deletions.run_next():
+        count += ran
+    failed = StorageDeletion.query.filter_by(status='failed').count()
+    click.echo(f"Ran {count} storage deletions, {failed} failed.")
@@ -0,0 +1,236 @@
+import os
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, tuple_
+
+from app import db
+from app.cache import settings_snapshot
+from app.models import HashJob, Installer, Package, PackageVersion, StorageDeletion, StorageOrphan, StorageScan
+from app.storage import basedir, blob_store, get_s3_client, storage_deletions
+
+BLOB_PREFIX = f'{blob_store.root}/blobs/'
+
+
+def list_local(start_after=None):
+    """Yield ``(path, size)`` of the files below the packages directory in path order, starting after ``start_after``.
+
+    Directories are read one at a time and subtrees before ``start_after`` are skipped without reading them.
+    """
+    after = start_after.split('/') if start_after else None
+
+    def walk(directory, parts):
+        with os.scandir(directory) as iterator:
+            entries = sorted(iterator, key=lambda entry: entry.name)
+        for entry in entries:
+            entry_parts = parts + [entry.name]
+            if entry.is_dir(follow_symlinks=False):
+                # Uploads being received, accounted_for() can't tell which installer they will belong to
+                if entry_parts == [blob_store.root, '.staging']:
+                    continue
+                if after is None or entry_parts >= after[:len(entry_parts)]:
+                    yield from walk(entry.path, entry_parts)
+            elif entry.is_file(follow_symlinks=False) and (after is None or entry_parts > after):
+                yield '/'.join(entry_parts), entry.stat().st_size
+
+    root = os.path.join(basedir, blob_store.root)
+    if os.path.isdir(root):
+        yield from walk(root, [blob_store.root])
+
+
+def list_s3(bucket, start_after=None, page_size=1000):
+    """Yield ``(key, size)`` of the objects below the packages prefix in key order, starting after ``start_after``."""
+    params = {'Bucket': bucket, 'Prefix': blob_store.root + '/', 'PaginationConfig': {'PageSize': page_size}}
+    if start_after:
+        params['StartAfter'] = start_after
+    for page in get_s3_client().get_paginator('list_objects_v2').paginate(**params):
+        for item in page.get('Contents', []):
+            if not item['Key'].endswith('/'):
+                yield item['Key'], item['Size']
+
+
+def blob_key(path):
+    return path[len(blob_store.root) + 1:] if path.startswith(BLOB_PREFIX) else None
+
+
+def accounted_for(paths):
+    """The subset of ``paths`` installers reference, hash jobs are about to read or deletions are queued for."""
+    found = set()
+    blob_keys = {blob_key(path) for path in paths} - {None}
+    if blob_keys:
+        found.update(blob_store.object_key(key) for key in db.session.execute(
+            select(Installer.storage_key)
+            .where(Installer.storage_key.in_(blob_keys), Installer.version_id.isnot(None))
+        ).scalars())
+
+    # packages/<publisher>/<identifier>/<version>/<architecture>/<file name> of installers stored before the blob store
+    legacy = [tuple(path.split('/')[1:]) for path in paths if not blob_key(path) and path.count('/') == 5]
+    if legacy:
+        rows = db.session.execute(
+            select(Package.publisher, Package.identifier, PackageVersion.version_code, Installer.architecture,
+                   Installer.file_name)
+            .join(PackageVersion, PackageVersion.identifier == Package.identifier)
+            .join(Installer, Installer.version_id == PackageVersion.id)
+            .where(
+                Installer.storage_key.is_(None),
+                tuple_(Package.publisher, Package.identifier, PackageVersion.version_code, Installer.architecture,
+                       Installer.file_name).in_(legacy),
+            )
+        )
+        found.update('/'.join((blob_store.root,) + tuple(row)) for row in rows)
+
+    # Browser uploads waiting for their hash job, and files the deletion queue already takes care of
+    found.update(db.session.execute(
+        select(HashJob.location).where(HashJob.source == 's3', HashJob.location.in_(paths))
+    ).scalars())
+    found.update(db.session.execute(select(StorageDeletion.path).where(StorageDeletion.path.in_(paths))).scalars())
+    return found
+
+
+def missing_blobs(after, upto, listed):
+    """Referenced blob keys in ``(after, upto]`` that are not in ``listed``, ``upto`` None means up to the last key."""
+    query = (
+        select(Installer.storage_key)
+        .where(Installer.storage_key.isnot(None), Installer.version_id.isnot(None))
+        .distinct()
+        .order_by(Installer.storage_key)
+    )
+    if after is not None:
+        query = query.where(Installer.storage_key > after)
+    if upto is not None:
+        query = query.where(Installer.storage_key <= upto)
+    return [key for key in db.session.execute(query.execution_options(yield_per=1000)).scalars() if key not in listed]
+
+
+def report_missing(key):
+    installer_ids = db.session.execute(
+        select(Installer.id).where(Installer.storage_key == key, Installer.version_id.isnot(None))
+    ).scalars().all()
+    click.echo(f"Missing blob {key}, used by installers {', '.join(map(str, installer_ids))}", err=True)
+
+
+@click.command('gc')
+@with_appcontext
+@click.option('--grace', type=float, default=None,
+              help='Hours a file has to stay unreferenced before it is reclaimed [default: STORAGE_GC_GRACE_PERIOD].')
+@click.option('--batch-size', default=1000, show_default=True, help='Files checked and committed per batch.')
+@click.option('--limit', type=int, default=None, help='Stop after checking this many files, the next run continues.')
+@click.option('--dry-run', is_flag=True, help='Report orphans and missing blobs without reclaiming anything.')
+@click.option('--restart', is_flag=True, help='Start a new scan instead of continuing an interrupted one.')
+def gc_command(grace, batch_size, limit, dry_run, restart):
+    """Reclaim stored files no installer references and report installers whose blob is missing.
+
+    The storage is listed page by page and every page is checked against the database. A file is marked as an orphan
+    when it is first found unreferenced and reclaimed by a later run once it stayed unreferenced for the grace period,
+    so uploads whose installer isn't created yet are kept. Progress is committed per page, an interrupted or limited
+    run is continued by the next one. A dry run writes nothing, it always checks everything from the start.
+    """
+    grace = current_app.config.get('STORAGE_GC_GRACE_PERIOD', 24) if grace is None else grace
+    bucket = settings_snapshot.get("BUCKET_NAME") if settings_snapshot.get("USE_S3") else None
+
+    if dry_run:
+        # Never added to the session, the scan a real run continues and the orphans stay as they are
+        scan = StorageScan(bucket=bucket, started_at=datetime.utcnow(), objects=0, bytes=0, orphans=0, reclaimed=0,
+                           missing=0)
+    else:
+        scan = StorageScan.query.filter_by(bucket=bucket, finished_at=None).order_by(StorageScan.id.desc()).first()
+        if scan is not None and restart:
+            db.session.delete(scan)
+            scan = None
+        if scan is None:
+            scan = StorageScan(bucket=bucket)
+            db.session.add(scan)
+            db.session.commit()
+        elif scan.last_path:
+            click.echo(f"Continuing the scan started at {scan.started_at} after {scan.last_path}")
+
+    listing = list_s3(bucket, scan.last_path, batch_size) if bucket else list_local(scan.last_path)
+    cutoff = datetime.utcnow() - timedelta(hours=grace)
+    checked = reclaimable = 0
+    finished = False
+    while limit is None or checked < limit:
+        page = list(islice(listing, batch_size if limit is None else min(batch_size, limit - checked)))
+        if not page:
+            finished = True
+            break
+        now = datetime.utcnow()
+        sizes = dict(page)
+        found = accounted_for(list(sizes))
+
+        listed_blobs = {blob_key(path) for path in sizes} - {None}
+        if listed_blobs:
+            upto = max(listed_blobs)
+            for key in missing_blobs(scan.last_blob_key, upto, listed_blobs):
+                report_missing(key)
+                scan.missing += 1
+            scan.last_blob_key = upto
+
+        unreferenced = [path for path in sizes if path not in found]
+        known = {
+            orphan.path: orphan
+            for orphan in StorageOrphan.query.filter_by(bucket=bucket).filter(StorageOrphan.path.in_(unreferenced))
+        }
+        if dry_run:
+            scan.orphans += len(unreferenced)
+            for path in unreferenced:
+                orphan = known.get(path)
+                if orphan is not None and orphan.first_seen <= cutoff:
+                    click.echo(f"Would reclaim {path} ({sizes[path]} bytes), unreferenced since {orphan.first_seen}")
+                    reclaimable += 1
+        else:
+            StorageOrphan.query.filter_by(bucket=bucket).filter(StorageOrphan.path.in_(found)).delete(
+                synchronize_session=False
+            )
+            for path in unreferenced:
+                orphan = known.get(path)
+                if orphan is None:
+                    db.session.add(
+                        StorageOrphan(bucket=bucket, path=path, size=sizes[path], first_seen=now, last_seen=now)
+                    )
+                elif orphan.first_seen <= cutoff:
+                    storage_deletions.enqueue(path, storage_key=blob_key(path))
+                    db.session.delete(orphan)
+                    scan.reclaimed += 1
+                    continue
+                else:
+                    orphan.size = sizes[path]
+                    orphan.last_seen = now
+                scan.orphans += 1
+
+        checked += len(page)
+        scan.objects += len(page)
+        scan.bytes += sum(sizes.values())
+        scan.last_path = page[-1][0]
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+    if not finished:
+        if dry_run:
+            click.echo(f"Stopped after {checked} files at {scan.last_path}")
+        else:
+            click.echo(f"Stopped after {checked} files, the next run continues after {scan.last_path}")
+        return
+
+    for key in missing_blobs(scan.last_blob_key, None, ()):
+        report_missing(key)
+        scan.missing += 1
+    if dry_run:
+        db.session.rollback()
+    else:
+        # Orphans the scan didn't come across anymore were removed some other way
+        StorageOrphan.query.filter_by(bucket=bucket).filter(StorageOrphan.last_seen < scan.started_at).delete(
+            synchronize_session=False
+        )
+        scan.finished_at = datetime.utcnow()
+        db.session.commit()
+        while storage_deletions.run_next():
+            pass
+    click.echo(
+        f"Checked {scan.objects} files ({scan.bytes} bytes): {scan.orphans} unreferenced, "
+        f"{reclaimable if dry_run else scan.reclaimed} {'reclaimable' if dry_run else 'reclaimed'}, "
+        f"{scan.missing} missing blobs."
+    )
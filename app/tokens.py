@@ -0,0 +1,131 @@
+import atexit
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import ApiToken, Role, User, split_list
+from app.principals import Principal, principals
+
+TOKEN_PREFIX = 'wgt_'
+
+
+def generate_token():
+    return TOKEN_PREFIX + secrets.token_urlsafe(32)
+
+
+def token_digest(token):
+    """HMAC-SHA256 of ``token``, keyed with API_TOKEN_SECRET or the SECRET_KEY.
+
+    Tokens are random, so a keyed hash is as good as bcrypt here and a token is found with one indexed lookup.
+    Changing the key revokes every token.
+    """
+    key = current_app.config.get('API_TOKEN_SECRET') or current_app.config['SECRET_KEY']
+    return hmac.new(key.encode('utf-8'), token.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def bearer_token(request):
+    """The token of an ``Authorization: Bearer`` header, or None."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    token = token.strip()
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return token
+
+
+def load_token_principal(token):
+    """Return the Principal of an unexpired API token, or None.
+
+    The principal is cached like the ones of sessions, keyed by the token's hash, so a pipeline calling the API
+    repeatedly only queries the database for its first request.
+    """
+    digest = token_digest(token)
+    key = ('token', digest)
+    entry = principals.get(key)
+    if entry is None or entry[1] <= time.monotonic():
+        api_token = (
+            ApiToken.query
+            .options(joinedload(ApiToken.user).joinedload(User.role).joinedload(Role.permissions))
+            .filter_by(token_hash=digest)
+            .first()
+        )
+        if api_token is None:
+            return None
+        principal = Principal.from_user(api_token.user, split_list(api_token.scopes), api_token.id)
+        entry = (principal, time.monotonic() + principals.ttl, api_token.expires_at)
+        principals.set(key, entry)
+
+    principal, _, expires_at = entry
+    if expires_at is not None and expires_at <= datetime.utcnow():
+        return None
+    token_usage.record(principal.token_id)
+    return principal
+
+
+class TokenUsage:
+    """Buffers when API tokens were last used per worker and writes them in batches.
+
+    Each flush runs one executemany of ``UPDATE api_token SET last_used_at = ...`` for the tokens used since the
+    last one, at most every ``flush_interval`` seconds and when the worker exits.
+    """
+
+    def __init__(self, flush_interval=60.0):
+        self.app = None
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('API_TOKEN_LAST_USED_INTERVAL', self.flush_interval)
+        atexit.register(self.flush)
+
+    def record(self, token_id):
+        with self._lock:
+            self._pending[token_id] = datetime.utcnow()
+            self._schedule()
+
+    def _schedule(self):
+        # Started lazily so no thread exists before gunicorn forks its workers
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending or self.app is None:
+            return
+
+        table = ApiToken.__table__
+        statement = update(table).where(table.c.id == bindparam('token_id')).values(last_used_at=bindparam('used_at'))
+        params = [{'token_id': token_id, 'used_at': used_at} for token_id, used_at in sorted(pending.items())]
+
+        # A fresh app context gets its own session, independent of any request being served
+        with self.app.app_context():
+            try:
+                db.session.execute(statement, params)
+                db.session.commit()
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                self.app.logger.error(f"Failed to record API token use, retrying later: {error}")
+                with self._lock:
+                    for token_id, used_at in pending.items():
+                        self._pending.setdefault(token_id, used_at)
+                    self._schedule()
+
+
+token_usage = TokenUsage()
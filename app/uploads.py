@@ -0,0 +1,55 @@
+import hashlib
+import os
+import uuid
+
+from flask import Request
+
+from app.storage import blob_store
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class HashingSpoolFile:
+    """Spool for an uploaded file that hashes every byte while werkzeug writes it.
+
+    The spool is created in the blob store's staging directory, so once the upload is parsed it can be moved to its
+    content-addressed location with a rename instead of a copy. A spool nobody persisted is removed when werkzeug
+    closes the request's files.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, uuid.uuid4().hex)
+        self._file = open(self.path, 'w+b', buffering=BUFFER_SIZE)
+        self._sha256 = hashlib.sha256()
+        self._persisted = False
+
+    def write(self, data):
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def persist(self):
+        """Flush and close the spool, the caller takes over the file at the returned path."""
+        self._file.close()
+        self._persisted = True
+        return self.path
+
+    def close(self):
+        self._file.close()
+        if not self._persisted and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request that spools uploaded files into the blob store's staging directory, hashing them on the way."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return HashingSpoolFile(blob_store.staging_directory)
@@ -1,36 +1,113 @@
+import base64
+import binascii
 import hashlib
 import os
-import requests
+import uuid
+from collections import namedtuple
 from flask import current_app, request
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
-from app.models import Installer, InstallerSwitch, NestedInstallerFile, Setting
+from app import db
+from app.models import Installer, InstallerSwitch, NestedInstallerFile, Package, PackageVersion, Setting
 from app.constants import installer_switches
-import boto3
-s3_client = boto3.client('s3')
-URL_EXPIRATION_SECONDS = 3600
+from app.cache import download_routes, package_counts
+from app.storage import blob_store, storage_deletions
+from app.jobs import hash_jobs, s3_checksum_sha256
+from app.uploads import HashingSpoolFile
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
-def get_file_hash_from_url(url, max_content_length=1024 * 1024 * 1024 * 10):  # Default max content length set to 10GB
-    """Download file from the given URL and return its SHA256 hash."""
-    
-    # Ensure the URL uses HTTPS
-    if not url.startswith("https://"):
-        raise ValueError("URL must use HTTPS.")
-    
-    response = requests.get(url, stream=True, timeout=15)  # Timeout set to 10 seconds
-    response.raise_for_status()  # Ensure we got an OK response
-    
-    # Check if the content length exceeds the max content length
-    content_length = int(response.headers.get('content-length', 0))
-    if content_length > max_content_length:
-        raise ValueError(f"Content length exceeds allowed limit of {max_content_length} bytes.")
-    
-    hash_sha256 = hashlib.sha256()
-    for chunk in response.iter_content(chunk_size=4096):
-        hash_sha256.update(chunk)
+# Everything the download route needs to serve an installer, resolved in one joined query
+InstallerRoute = namedtuple('InstallerRoute', [
+    'package_id', 'identifier', 'publisher', 'version_code', 'architecture', 'file_name', 'external_url', 'installer_sha256',
+    'storage_key',
+])
+
+
+# Fields of the /api/packages list, versions and installers are only counted
+PACKAGE_LIST_FIELDS = (
+    'id', 'identifier', 'name', 'publisher', 'download_count', 'moniker', 'tags', 'latest_version', 'version_count',
+    'installer_count',
+)
+
+
+def package_list_columns(fields):
+    """Labelled columns of the package list ``fields``, the counts are correlated subqueries over indexed columns."""
+    columns = {
+        'id': Package.id,
+        'identifier': Package.identifier,
+        'name': Package.name,
+        'publisher': Package.publisher,
+        'download_count': Package.download_count,
+        'moniker': Package.moniker,
+        'tags': Package.tags,
+        'latest_version': select(PackageVersion.version_code)
+        .where(PackageVersion.id == Package.latest_version_id)
+        .scalar_subquery(),
+        'version_count': select(func.count(PackageVersion.id))
+        .where(PackageVersion.identifier == Package.identifier)
+        .scalar_subquery(),
+        'installer_count': select(func.count(Installer.id))
+        .join(PackageVersion, Installer.version_id == PackageVersion.id)
+        .where(PackageVersion.identifier == Package.identifier)
+        .scalar_subquery(),
+    }
+    return [columns[field].label(field) for field in fields]
+
+
+def encode_cursor(package_id):
+    return base64.urlsafe_b64encode(str(package_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The package id a cursor continues after, None if the cursor is malformed."""
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
 
-    return hash_sha256.hexdigest()
+def count_packages(search, condition=None):
+    """Number of packages matching ``condition``, cached per search until packages change."""
+    total = package_counts.get(search)
+    if total is None:
+        query = select(func.count(Package.id))
+        if condition is not None:
+            query = query.where(condition)
+        total = db.session.execute(query).scalar()
+        package_counts.set(search, total)
+    return total
+
+
+def resolve_download(identifier, version, architecture, scope):
+    """Return the InstallerRoute for a download URL, or None if no installer matches."""
+    key = (identifier, version, architecture, scope)
+    route = download_routes.get(key)
+    if route is not None:
+        return route
+
+    row = (
+        db.session.query(
+            Package.id, Package.identifier, Package.publisher, PackageVersion.version_code,
+            Installer.architecture, Installer.file_name, Installer.external_url, Installer.installer_sha256,
+            Installer.storage_key,
+        )
+        .join(PackageVersion, PackageVersion.identifier == Package.identifier)
+        .join(Installer, Installer.version_id == PackageVersion.id)
+        .filter(
+            Package.identifier == identifier,
+            PackageVersion.version_code == version,
+            Installer.architecture == architecture,
+            Installer.scope == scope,
+        )
+        .first()
+    )
+    if row is None:
+        return None
+    route = InstallerRoute(*row)
+    download_routes.set(key, route)
+    return route
 
 
 def create_installer(publisher, identifier, version, installer_form):
@@ -42,33 +119,34 @@ def create_installer(publisher, identifier, version, installer_form):
     scope = installer_form.installer_scope.data
     nestedinstallertype = installer_form.nestedinstallertype.data
     nestedinstallerpath = installer_form.nestedinstallerpath.data
-
+    storage_key = None
+    hash_source = None
 
     # If file is provided, save the file
     if file:
         file_name = secure_filename(file.filename)
         file_name = f'{scope}.' + file_name.rsplit('.', 1)[1]
-        hash = save_file(file, file_name, publisher, identifier, version, architecture)
+        hash = save_file(file)
         if hash is None:
             return "Error saving file", 500
+        storage_key = blob_store.key_for(hash)
     elif not file and external_url and is_aws:
         current_app.logger.info("Installer is on AWS")
         file_name = external_url
         s3_object_key = f'packages/{publisher}/{identifier}/{version}/{architecture}/{file_name}'
         external_url = None
 
-        # Generate a pre-signed URL for S3 uploads
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': Setting.get("BUCKET_NAME").get_value(), 'Key': s3_object_key},
-            ExpiresIn=URL_EXPIRATION_SECONDS
-        )
-        current_app.logger.info(f"Getting file hash from presigned URL: {presigned_url}")
-        hash = get_file_hash_from_url(presigned_url)
+        # S3 verified the checksum the browser sent with the upload, without one the object is hashed by a job
+        hash = s3_checksum_sha256(s3_object_key)
+        if hash:
+            storage_key = blob_store.store_s3(s3_object_key, hash)
+        else:
+            hash_source = ('s3', s3_object_key)
     # If no file is provided, but an external_url is available, use that
     elif external_url:
-        current_app.logger.info("Getting file hash from external URL")
-        hash = get_file_hash_from_url(external_url)
+        current_app.logger.info("Queueing hash job for external URL")
+        hash = None
+        hash_source = ('url', external_url)
         file_name = None
 
         
@@ -82,8 +160,15 @@ def create_installer(publisher, identifier, version, installer_form):
         file_name=file_name,
         external_url=external_url,
         installer_sha256=hash,
-        scope=scope
+        scope=scope,
+        storage_key=storage_key,
+        product_code=installer_form.product_code.data or None,
+        upgrade_code=installer_form.upgrade_code.data or None,
+        package_family_name=installer_form.package_family_name.data or None,
+        commands=installer_form.commands.data or None,
     )
+    if hash_source:
+        hash_jobs.submit(installer, *hash_source)
 
     for field_name in installer_switches:
         current_app.logger.debug(f"Checking for field name {field_name}")
@@ -109,46 +194,63 @@ def calculate_sha256(filename):
 
     with open(filename, 'rb') as file:
         # Read the file in chunks to efficiently handle large files
-        for chunk in iter(lambda: file.read(4096), b''):
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
             sha256_hash.update(chunk)
 
     return sha256_hash.hexdigest()
 
 
 def delete_installer_util(package, installer, version):
-    if not installer.external_url and installer.file_name:
-        base_path = ['packages', package.publisher, package.identifier, version.version_code, installer.architecture]
-        if Setting.get("USE_S3").get_value():
-            s3_key = '/'.join(base_path + [installer.file_name])
-            current_app.logger.info(f"Deleting file from S3: {s3_key}")
-            s3_client.delete_object(
-                Bucket=Setting.get("BUCKET_NAME").get_value(),
-                Key=s3_key
-            )
-        else:
-            # Construct the file system path
-            installer_path = os.path.join(basedir, *base_path, installer.file_name)
-            if os.path.exists(installer_path):
-                current_app.logger.info(f"Deleting file from local file system: {installer_path}")
-                os.remove(installer_path)
+    """Queue the installer's file for deletion, committed with the caller's session."""
+    # Blobs can be shared, they are queued through blob_store.release() instead
+    if not installer.external_url and installer.file_name and not installer.storage_key:
+        path = '/'.join(['packages', package.publisher, package.identifier, version.version_code,
+                         installer.architecture, installer.file_name])
+        current_app.logger.info(f"Queueing deletion of {path}")
+        storage_deletions.enqueue(path)
+
 
+def delete_version_installers(package, versions):
+    """Delete the installers of ``versions`` and queue their files, committed with the caller's session."""
+    storage_keys = []
+    for version in versions:
+        for installer in version.installers:
+            delete_installer_util(package, installer, version)
+            storage_keys.append(installer.storage_key)
+            db.session.delete(installer)
+    blob_store.release(storage_keys)
 
-def save_file(file, file_name, publisher, identifier, version, architecture):
-    publisher = secure_filename(publisher)
-    identifier = secure_filename(identifier)
-    version = secure_filename(version)
-    architecture = secure_filename(architecture)
 
+def installers_for_deletion():
+    """Loader option for PackageVersion queries, loads what deleting the installers touches in a few queries."""
+    return selectinload(PackageVersion.installers).options(
+        selectinload(Installer.switches),
+        selectinload(Installer.nested_installer_files),
+        selectinload(Installer.hash_job),
+    )
 
-    # Create directory if it doesn't exist
-    save_directory = os.path.join(basedir, 'packages', publisher, identifier, version, architecture)
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
 
-    # Save file locally
-    file_path = os.path.join(save_directory, file_name)
-    file.save(file_path)
+def save_file(file):
+    """Store an uploaded installer in the blob store and return its SHA256 hash."""
+    stream = file.stream
+    if isinstance(stream, HashingSpoolFile):
+        # Already hashed while the upload was spooled, storing it is a rename within the packages directory
+        hash = stream.hexdigest()
+        staging_path = stream.persist()
+        try:
+            blob_store.store_local(staging_path, hash)
+        finally:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+        return hash
 
-    # Get file hash
-    hash = calculate_sha256(file_path)
-    return hash
\ No newline at end of file
+    os.makedirs(blob_store.staging_directory, exist_ok=True)
+    staging_path = os.path.join(blob_store.staging_directory, uuid.uuid4().hex)
+    try:
+        file.save(staging_path)
+        hash = calculate_sha256(staging_path)
+        blob_store.store_local(staging_path, hash)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    return hash
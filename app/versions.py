@@ -0,0 +1,58 @@
+import re
+
+# WinGet parses every part into an unsigned 64 bit integer
+MAX_INTEGER = 2 ** 64 - 1
+# Most parts a version_code of 50 characters can have, every key is padded to this many parts
+MAX_PARTS = 26
+SORT_KEY_LENGTH = 255
+
+_LEADING_INTEGER = re.compile(r'\s*(\d*)(.*)', re.S)
+
+
+def version_parts(version):
+    """Split a version into (integer, other) parts the way WinGet's Version class does.
+
+    Leading non-digits are dropped when a digit comes before the first dot ("v1.2" is "1.2"), every dot separated
+    part is a leading integer followed by the rest of the part, and trailing parts equal to zero are removed, so
+    "1.0.0" equals "1".
+    """
+    version = (version or '').strip()
+    digit = re.search(r'\d', version)
+    dot = version.find('.')
+    if digit is not None and (dot == -1 or digit.start() < dot):
+        version = version[digit.start():]
+
+    parts = []
+    for part in version.split('.'):
+        integer, other = _LEADING_INTEGER.match(part.strip()).groups()
+        if integer and int(integer) > MAX_INTEGER:
+            # An integer WinGet can't parse makes the whole part a string
+            integer, other = '', part.strip()
+        parts.append((int(integer or 0), other))
+    while parts and parts[-1] == (0, ''):
+        parts.pop()
+    return parts
+
+
+def _encode_part(integer, other):
+    digits = str(integer)
+    # The digit count in front makes longer numbers sort after shorter ones
+    key = f'{len(digits):02d}{digits}'
+    if not other:
+        # A part without a suffix sorts after the same number with one, "1.0" comes after "1.0-beta"
+        return key + '1'
+    # Hex of the case folded suffix only uses characters every collation orders the same way, "00" ends it
+    return key + '0' + other.casefold().encode('utf-8').hex() + '00'
+
+
+def version_sort_key(version):
+    """String that orders like WinGet compares versions, for an indexed ORDER BY version_sort_key.
+
+    Every part is encoded so that comparing the encodings compares the parts and no encoding is a prefix of
+    another. Missing parts compare as zero, so keys are padded with zero parts to MAX_PARTS parts.
+    """
+    if version is None:
+        return None
+    parts = version_parts(version)[:MAX_PARTS]
+    parts += [(0, '')] * (MAX_PARTS - len(parts))
+    return ''.join(_encode_part(integer, other) for integer, other in parts)[:SORT_KEY_LENGTH]
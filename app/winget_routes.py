@@ -1,33 +1,124 @@
 
+import base64
+import binascii
+import hashlib
 import os
-from flask import Blueprint, jsonify, render_template, request, redirect, url_for, current_app, send_from_directory, flash
+from flask import Blueprint, jsonify, render_template, request, redirect, url_for, current_app, send_from_directory, flash, g, has_request_context
 from flask_login import login_required
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, event, or_, select
+from sqlalchemy.orm import Session, raiseload, selectinload
 from werkzeug.http import parse_range_header
 from werkzeug.utils import secure_filename
 
 from app.utils import create_installer, save_file, basedir
 from app import db, settings
-from app.models import InstallerSwitch, Package, PackageVersion, Installer, Setting, User
+from app.cache import manifest_cache, settings_snapshot
+from app.search import search_index
+from app.serializers import manifest_search as serialize_manifest_search, package_manifest
+from app.models import InstallerSwitch, Package, PackageMatchKey, PackageVersion, Installer, Setting, User
 
 
 winget = Blueprint('winget', __name__)
 
+
+def manifest_tree_options():
+    """Loader options that fetch a package's published manifest tree with one SELECT per level.
+
+    Installers still waiting for their hash are left out, so WinGet never sees one without an InstallerSha256.
+    """
+    installers = PackageVersion.installers.and_(Installer.is_published())
+    return selectinload(Package.versions).selectinload(installers).options(
+        selectinload(Installer.switches),
+        selectinload(Installer.nested_installer_files),
+    )
+
+
+@winget.before_request
+def guard_lazy_loads():
+    # With WINGET_RAISE_ON_LAZY_LOAD enabled every relationship that isn't eagerly loaded raises instead of
+    # silently issuing another SELECT, so N+1 regressions surface in tests
+    if current_app.config.get('WINGET_RAISE_ON_LAZY_LOAD', False):
+        g.raise_on_lazy_load = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _raise_on_lazy_load(orm_execute_state):
+    if not has_request_context() or not g.get('raise_on_lazy_load'):
+        return
+    if orm_execute_state.is_select and not orm_execute_state.is_relationship_load:
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload('*'))
+
+
 @winget.route('/')
 def index():
     return "WinGet API is running, see documentation for more information", 200
 
 @winget.route('/information')
 def information():
-    return jsonify({"Data": {"SourceIdentifier": Setting.get("REPO_NAME").get_value(), "ServerSupportedVersions": ["1.4.0", "1.5.0"]}})
+    return jsonify({"Data": {"SourceIdentifier": settings_snapshot.get("REPO_NAME"), "ServerSupportedVersions": ["1.4.0", "1.5.0"]}})
     
 @winget.route('/packageManifests/<name>', methods=['GET'])
 def get_package_manifest(name):
-    package = Package.query.filter_by(identifier=name).first()
-    if package is None:
-        return jsonify({}), 204
-    return jsonify(package.generate_output())
-
+    # Installer URLs are absolute, so the serialized manifest depends on the host it was requested through
+    cache_key = (request.host, name)
+    cached = manifest_cache.get(cache_key)
+    if cached is None:
+        package = Package.query.options(manifest_tree_options()).filter_by(identifier=name).first()
+        if package is None:
+            return jsonify({}), 204
+        body = package_manifest(package)
+        cached = (body, hashlib.sha256(body).hexdigest())
+        manifest_cache.set(cache_key, cached)
+
+    body, etag = cached
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+
+def encode_continuation_token(last_id, remaining):
+    return base64.urlsafe_b64encode(f'{last_id}:{remaining}'.encode()).decode()
+
+
+def decode_continuation_token(token):
+    """Return the (last package id, remaining results) pair stored in a ContinuationToken."""
+    try:
+        last_id, remaining = base64.urlsafe_b64decode(token.encode()).decode().split(':')
+        last_id, remaining = int(last_id), int(remaining)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError(f"Invalid ContinuationToken: {token}")
+    if remaining < 1:
+        raise ValueError(f"Invalid ContinuationToken: {token}")
+    return last_id, remaining
+
+
+def parse_maximum_results(value):
+    """Return the MaximumResults of a manifestSearch request as a positive int, 50 if it is missing."""
+    if value is None:
+        return 50
+    try:
+        maximum_results = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid MaximumResults: {value}")
+    if maximum_results < 1:
+        raise ValueError(f"Invalid MaximumResults: {value}")
+    return maximum_results
+
+
+def match_key_condition(match_field, keyword, match_type):
+    value = PackageMatchKey.normalize(keyword)
+    if match_type in ['Exact', 'CaseInsensitive']:
+        value_condition = PackageMatchKey.value == value
+    elif match_type in ['StartsWith']:
+        value_condition = PackageMatchKey.value.startswith(value, autoescape=True)
+    elif match_type in ['Partial', 'Substring']:
+        value_condition = PackageMatchKey.value.contains(value, autoescape=True)
+    else:
+        return None
+    package_ids = select(PackageMatchKey.package_id).where(PackageMatchKey.field == match_field, value_condition)
+    return Package.id.in_(package_ids)
 
 
 @winget.route('/manifestSearch', methods=['POST'])
@@ -35,10 +126,28 @@ def manifest_search():
     request_data = request.get_json()
     current_app.logger.info(f"Received manifestSearch request: {request_data}")
 
-    maximum_results = request_data.get('MaximumResults', 50)
-
-    # Initialize the base query
-    packages_query = Package.query
+    try:
+        maximum_results = parse_maximum_results(request_data.get('MaximumResults'))
+    except ValueError as error:
+        current_app.logger.warning(str(error))
+        return jsonify({"ErrorCode": 400, "ErrorMessage": str(error)}), 400
+    last_id = 0
+
+    # The token carries the last returned package id so the next page is a keyset seek on the primary key
+    continuation_token = request_data.get('ContinuationToken') or request.headers.get('ContinuationToken')
+    if continuation_token:
+        try:
+            last_id, maximum_results = decode_continuation_token(continuation_token)
+        except ValueError as error:
+            current_app.logger.warning(str(error))
+            return jsonify({"ErrorCode": 400, "ErrorMessage": str(error)}), 400
+
+    page_size = min(maximum_results, current_app.config.get('MANIFEST_SEARCH_PAGE_SIZE', 50))
+
+    # Only packages with at least one installer are returned, and only their versions that have installers are loaded
+    packages_query = Package.query.filter(
+        Package.versions.any(PackageVersion.has_installers())
+    ).options(selectinload(Package.versions.and_(PackageVersion.has_installers())))
 
     # Process Filters and Inclusions
     combined_filters = request_data.get('Filters', []) + request_data.get('Inclusions', [])
@@ -51,28 +160,37 @@ def manifest_search():
         match_type = main_query.get('MatchType')
         if match_type == 'Exact':
             filter_conditions.append(or_(Package.name == keyword, Package.identifier == keyword))
+        elif keyword:
+            filter_conditions.append(search_index.condition(keyword, ('name', 'identifier')))
 
 
     for filter_entry in combined_filters:
+        match_field = filter_entry.get('PackageMatchField')
+        keyword = filter_entry.get('RequestMatch', {}).get('KeyWord', '')
+        match_type = filter_entry.get('RequestMatch', {}).get('MatchType')
+
+        # ProductCode, Moniker, Tag etc. are resolved with an index lookup on the normalized match key table
+        if match_field in PackageMatchKey.FIELDS:
+            condition = match_key_condition(match_field, keyword, match_type)
+            if condition is None:
+                current_app.logger.warning(f"Invalid match type: {match_type}")
+                continue
+            filter_conditions.append(condition)
+            continue
+
         field = {
             'PackageName': Package.name,
             'PackageIdentifier': Package.identifier,
-            'PackageFamilyName': Package.identifier,  # Update these mappings based on your schema
-            'ProductCode': Package.name,       # Update these mappings based on your schema
-            'Moniker': Package.name                 # Update these mappings based on your schema
-        }.get(filter_entry.get('PackageMatchField'))
+        }.get(match_field)
 
         if not field:
-            current_app.logger.warning(f"Unsupported PackageMatchField: {filter_entry.get('PackageMatchField')}")
+            current_app.logger.warning(f"Unsupported PackageMatchField: {match_field}")
             continue
 
-        keyword = filter_entry.get('RequestMatch', {}).get('KeyWord', '')
-        match_type = filter_entry.get('RequestMatch', {}).get('MatchType')
-
         if match_type == 'Exact':
             filter_conditions.append(field == keyword)
         elif match_type in ['Partial', 'Substring', 'CaseInsensitive']:
-            filter_conditions.append(field.ilike(f'%{keyword}%'))
+            filter_conditions.append(search_index.condition(keyword, (field.key,)))
         else:
             current_app.logger.warning(f"Invalid match type: {match_type}")
             continue
@@ -84,20 +202,19 @@ def manifest_search():
     if filter_conditions:
         packages_query = packages_query.filter(or_(*filter_conditions))
 
-    # Apply limit and execute query
-    packages_query = packages_query.limit(maximum_results)
-    packages = packages_query.all()
-
-    # Generate output data
-    output_data = [
-            package.generate_output_manifest_search()
-            for package in packages
-            if package.versions and any(version.installers for version in package.versions)
-        ]
-    if not output_data:
+    # Fetch one extra row to know whether another page exists
+    packages = packages_query.filter(Package.id > last_id).order_by(Package.id).limit(page_size + 1).all()
+    has_more = len(packages) > page_size and maximum_results > page_size
+    packages = packages[:page_size]
+
+    if not packages:
         current_app.logger.info("No packages found.")
         return jsonify({}), 204
 
-    current_app.logger.info(f"Returning {len(output_data)} packages.")
-    current_app.logger.info(f"Output Data: {output_data}")
-    return jsonify({"Data": output_data})
\ No newline at end of file
+    current_app.logger.info(f"Returning {len(packages)} packages.")
+    continuation_token = None
+    if has_more:
+        continuation_token = encode_continuation_token(packages[-1].id, maximum_results - page_size)
+    return current_app.response_class(
+        serialize_manifest_search(packages, continuation_token), mimetype='application/json'
+    )
@@ -0,0 +1,140 @@
+"""Measure /wg manifest latency while a burst of logins is checked, with bcrypt on the gevent loop and in the thread pool.
+
+Usage: python benchmarks/login_burst.py [--logins 40] [--fetchers 8] [--duration 3]
+
+The app is served by a gevent WSGI server in this process, the way a gunicorn gevent worker runs it, with a
+throwaway SQLite database. For each variant the fetchers request /wg/packageManifests in a loop, first alone and
+then while ``--logins`` logins arrive at once, and the latency percentiles of both phases are printed.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import http.client
+import os
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+
+def create_app(database):
+    os.environ['WINGETTY_SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    # create_app skips seeding permissions and settings when "db" is in argv, the tables don't exist yet
+    argv, sys.argv = sys.argv, ['db']
+    try:
+        from app import create_app
+        return create_app()
+    finally:
+        sys.argv = argv
+
+
+def seed(app, users):
+    from app import db
+    from app.models import Installer, Package, PackageVersion, Role, User
+    from app.permissions import create_all as create_permissions
+    from app.settings import create_all as create_settings
+
+    with app.app_context():
+        db.create_all()
+        create_permissions()
+        create_settings()
+        package = Package(identifier='Bench.Package', name='Bench Package', publisher='Bench', download_count=0)
+        for v in range(20):
+            version = PackageVersion(version_code=f'1.{v}.0', package_locale='en-US', short_description='Benchmark',
+                                     identifier=package.identifier)
+            version.installers.append(Installer(architecture='x64', installer_type='exe', file_name='setup.exe',
+                                                installer_sha256='ab' * 32, scope='machine'))
+            package.versions.append(version)
+        db.session.add(package)
+
+        role = Role.query.filter_by(name='viewer').first()
+        user = User(username='bench0', email='bench0@example.com', role=role)
+        user.set_password('benchmark')
+        db.session.add(user)
+        # Same hash for every user, hashing them one by one would only slow down the setup
+        for i in range(1, users):
+            db.session.add(User(username=f'bench{i}', email=f'bench{i}@example.com', role=role, password=user.password))
+        db.session.commit()
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+    started = time.perf_counter()
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status, time.perf_counter() - started
+
+
+def fetch_manifests(port, until, latencies):
+    while time.perf_counter() < until:
+        status, seconds = request(port, 'GET', '/wg/packageManifests/Bench.Package')
+        assert status == 200, status
+        latencies.append(seconds)
+
+
+def login(port, i, results):
+    body = urlencode({'emailorusername': f'bench{i}', 'password': 'benchmark'})
+    results.append(request(port, 'POST', '/login', body))
+
+
+def percentiles(latencies):
+    points = statistics.quantiles(latencies, n=100)
+    return (f"p50 {points[49] * 1000:7.1f} ms  p99 {points[98] * 1000:7.1f} ms  "
+            f"max {max(latencies) * 1000:7.1f} ms  ({len(latencies)} requests)")
+
+
+def run(port, fetchers, logins, duration):
+    quiet = []
+    gevent.joinall([gevent.spawn(fetch_manifests, port, time.perf_counter() + duration, quiet)
+                    for _ in range(fetchers)])
+
+    burst, results = [], []
+    started = time.perf_counter()
+    workers = [gevent.spawn(fetch_manifests, port, started + duration, burst) for _ in range(fetchers)]
+    login_workers = [gevent.spawn(login, port, i, results) for i in range(logins)]
+    gevent.joinall(login_workers)
+    logins_done = time.perf_counter() - started
+    gevent.joinall(workers)
+
+    statuses = sorted({status for status, _ in results})
+    print(f"  /wg alone        {percentiles(quiet)}")
+    print(f"  /wg during burst {percentiles(burst)}")
+    print(f"  {logins} logins took {logins_done:.2f} s, statuses {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=40, help='Logins arriving at once')
+    parser.add_argument('--fetchers', type=int, default=8, help='Concurrent winget clients fetching manifests')
+    parser.add_argument('--duration', type=float, default=3.0, help='Seconds each phase runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(os.path.join(directory, 'bench.db'))
+        seed(app, args.logins)
+        from app.passwords import password_hasher
+
+        server = WSGIServer(('127.0.0.1', 0), app, log=None)
+        server.start()
+        try:
+            for name, threads in (('bcrypt on the gevent loop', 0), ('bcrypt in the thread pool', 2)):
+                password_hasher.threads = threads
+                print(name)
+                run(server.server_port, args.fetchers, args.logins, args.duration)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Compare the packageManifests serializer with building the manifest dict and encoding it with Flask's JSON provider.
+
+Usage: python benchmarks/manifest_serializer.py [--versions 200] [--installers 4] [--number 50]
+
+The package is created in a throwaway SQLite database, the timings only cover serialization of the already
+loaded manifest tree. orjson is timed as a third variant when it is installed.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+
+def create_app(database):
+    os.environ['WINGETTY_SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    # create_app skips seeding permissions and settings when "db" is in argv, the tables don't exist yet
+    argv, sys.argv = sys.argv, ['db']
+    try:
+        from app import create_app
+        return create_app()
+    finally:
+        sys.argv = argv
+
+
+def seed(db, versions, installers):
+    from app.models import Installer, InstallerSwitch, NestedInstallerFile, Package, PackageVersion
+
+    package = Package(identifier='Bench.Package', name='Bench Package', publisher='Bench', moniker='bench',
+                      tags='bench,serializer,manifest', download_count=0)
+    architectures = ['x64', 'x86', 'arm64', 'arm']
+    for v in range(versions):
+        version = PackageVersion(version_code=f'1.{v}.0', package_locale='en-US', short_description='Benchmark',
+                                 identifier=package.identifier)
+        for i in range(installers):
+            installer = Installer(
+                architecture=architectures[i % len(architectures)],
+                installer_type='zip' if i % 2 else 'exe',
+                file_name='setup.exe',
+                installer_sha256=f'{v:032x}{i:032x}',
+                scope='both' if i % 3 == 0 else 'machine',
+                product_code='{%08d-0000-0000-0000-000000000000}' % i,
+                commands='bench,bench-cli',
+            )
+            installer.switches.extend([
+                InstallerSwitch(parameter='Silent', value='/S'),
+                InstallerSwitch(parameter='SilentWithProgress', value='/S /progress'),
+            ])
+            if installer.installer_type == 'zip':
+                installer.nested_installer_type = 'exe'
+                installer.nested_installer_files.append(NestedInstallerFile(relative_file_path='bench.exe'))
+            version.installers.append(installer)
+        package.versions.append(version)
+    db.session.add(package)
+    db.session.commit()
+    return package.identifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, default=200)
+    parser.add_argument('--installers', type=int, default=4, help='Installers per version')
+    parser.add_argument('--number', type=int, default=50, help='Serializations per variant')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(os.path.join(directory, 'bench.db'))
+        from app import db
+        from app.models import Package
+        from app.serializers import package_manifest
+        from app.winget_routes import manifest_tree_options
+
+        with app.app_context():
+            db.create_all()
+            identifier = seed(db, args.versions, args.installers)
+
+        with app.test_request_context('/wg/packageManifests/' + identifier, base_url='https://winget.example.com'):
+            package = Package.query.options(manifest_tree_options()).filter_by(identifier=identifier).first()
+            variants = {
+                'dict + flask json': lambda: app.json.dumps(package.generate_output()).encode(),
+                'serializer': lambda: package_manifest(package),
+            }
+            try:
+                import orjson
+                variants['dict + orjson'] = lambda: orjson.dumps(package.generate_output())
+            except ImportError:
+                pass
+
+            expected = json.loads(variants['dict + flask json']())
+            for name, variant in variants.items():
+                if json.loads(variant()) != expected:
+                    raise SystemExit(f"{name} produced a different manifest")
+
+            print(f"{args.versions} versions x {args.installers} installers, "
+                  f"{len(variants['serializer']())} bytes, best of 5 x {args.number}")
+            baseline = None
+            for name, variant in variants.items():
+                seconds = min(timeit.repeat(variant, number=args.number, repeat=5)) / args.number
+                baseline = baseline or seconds
+                print(f"  {name:<20} {seconds * 1000:8.2f} ms  {baseline / seconds:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Measure cold start time and per-worker memory, with and without gunicorn.conf.py (preload_app, gc.freeze).
+
+Usage: python benchmarks/startup.py [--workers 4] [--runs 5]
+
+Times create_app() in a fresh interpreter, the migration step of start.sh on an up-to-date database, and how long
+gunicorn takes until it answers. Then it reads RSS, PSS and private memory of the master and the workers from
+/proc/<pid>/smaps_rollup (Linux only). Everything runs against a throwaway SQLite database.
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def timed(command, env, runs):
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - started)
+    return statistics.median(seconds)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def memory(pid):
+    """RSS, PSS and private (USS) memory of ``pid`` in MiB."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return values['Rss'], values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        return [int(child) for child in file.read().split()]
+
+
+def serve(arguments, env, workers):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/wg/information'
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '--workers', str(workers)] + arguments
+        + ['app:create_app()'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                raise SystemExit(f"gunicorn {' '.join(arguments)} exited with {process.returncode}")
+            try:
+                urllib.request.urlopen(url, timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - started
+
+        # Give every worker time to finish loading and spread some requests over them
+        time.sleep(3)
+        for _ in range(50 * workers):
+            urllib.request.urlopen(url).read()
+
+        master = memory(process.pid)
+        worker_memory = [memory(pid) for pid in children(process.pid)]
+        return ready, master, worker_memory
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5, help='Runs of each timed command, the median is printed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, FLASK_APP='app',
+                   WINGETTY_SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(directory, 'bench.db'))
+        subprocess.run(['flask', 'db', 'upgrade'], cwd=ROOT, env=env, check=True, capture_output=True)
+
+        create_app = [sys.executable, '-c', 'from app import create_app; create_app()']
+        print(f"create_app() in a new interpreter   {timed(create_app, env, args.runs):6.2f} s")
+        print(f"flask db upgrade, nothing to do     {timed(['flask', 'db', 'upgrade'], env, args.runs):6.2f} s")
+        check = [sys.executable, 'check_migrations.py']
+        print(f"check_migrations.py, nothing to do  {timed(check, env, args.runs):6.2f} s")
+
+        # gunicorn reads ./gunicorn.conf.py unless it is given another config file
+        baseline_config = os.path.join(directory, 'gunicorn.conf.py')
+        open(baseline_config, 'w').close()
+        variants = {
+            'gunicorn -k gevent': ['-c', baseline_config, '--worker-class', 'gevent'],
+            'gunicorn -c gunicorn.conf.py': ['-c', 'gunicorn.conf.py'],
+        }
+        for name, arguments in variants.items():
+            ready, master, workers = serve(arguments, env, args.workers)
+            rss, pss, private = (statistics.mean(values) for values in zip(*workers))
+            total = master[1] + sum(worker[1] for worker in workers)
+            print(f"{name}")
+            print(f"  answering after {ready:.2f} s")
+            print(f"  master  RSS {master[0]:6.1f} MiB  PSS {master[1]:6.1f} MiB  private {master[2]:6.1f} MiB")
+            print(f"  worker  RSS {rss:6.1f} MiB  PSS {pss:6.1f} MiB  private {private:6.1f} MiB  (mean of {len(workers)})")
+            print(f"  total PSS {total:6.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Exit with 0 if the database is at the newest migration and 1 if "flask db upgrade" has to run.
+
+start.sh runs this before starting gunicorn. It only loads alembic and SQLAlchemy, unlike "flask db upgrade",
+which imports the whole app even when there is nothing to upgrade.
+"""
+import os
+import sys
+
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import settings
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+def database_url():
+    url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+    # Flask-SQLAlchemy puts relative SQLite databases in the instance folder
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:' \
+            and not url.database.startswith('file:') and not os.path.isabs(url.database):
+        url = url.set(database=os.path.join(basedir, 'instance', url.database))
+    return url
+
+
+def main():
+    script = ScriptDirectory(os.path.join(basedir, 'migrations'))
+    engine = create_engine(database_url())
+    try:
+        with engine.connect() as connection:
+            context = MigrationContext.configure(connection)
+            current = set(context.get_current_heads())
+            # The first migration inspects the database when it is loaded, which needs alembic's op proxy
+            with Operations.context(context):
+                heads = set(script.get_heads())
+    except SQLAlchemyError as error:
+        print(f"Couldn't read the database revision: {error}")
+        return 1
+    finally:
+        engine.dispose()
+
+    if current == heads:
+        print(f"Database is at the newest migration {', '.join(sorted(heads))}")
+        return 0
+    print(f"Database is at {', '.join(sorted(current)) or 'no migration'}, newest is {', '.join(sorted(heads))}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""Gunicorn settings for start.sh.
+
+The app is created once in the master and the workers are forked from it (preload_app), so a worker starts
+without importing anything and shares the pages of the loaded app with the master until it writes to them.
+"""
+import gc
+import os
+
+# Patched before the app is loaded in the master, so the locks created while loading it cooperate with gevent
+from gevent import monkey
+
+monkey.patch_all()
+
+bind = ':8080'
+workers = int(os.environ.get('WORKERS', 4))
+worker_class = 'gevent'
+preload_app = True
+
+
+def when_ready(server):
+    # The master serves no requests, close the connections create_app opened for seeding
+    from app import dispose_engines
+    dispose_engines(server.app.wsgi())
+
+
+def pre_fork(server, worker):
+    # Objects that exist now are never freed, a collection in a worker would otherwise touch and copy their pages
+    gc.freeze()
@@ -0,0 +1,25 @@
+"""Add settings change stamp
+
+Revision ID: a83e52d1c7f0
+Revises: 279cc0e4fc73
+Create Date: 2026-10-18 17:21:40.903318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83e52d1c7f0'
+down_revision = '279cc0e4fc73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Bumped by update_setting so every worker rebuilds its settings snapshot
+    op.execute("INSERT INTO change_stamp (name, value) VALUES ('settings', 0)")
+
+
+def downgrade():
+    op.execute("DELETE FROM change_stamp WHERE name = 'settings'")
@@ -0,0 +1,49 @@
+"""Add package search index
+
+Revision ID: c41f7a9d2e6b
+Revises: fd6ef6474288
+Create Date: 2026-10-18 17:05:12.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7a9d2e6b'
+down_revision = 'fd6ef6474288'
+branch_labels = None
+depends_on = None
+
+search_fields = ['name', 'identifier', 'publisher']
+
+
+def upgrade():
+    # The in-process index used on other databases is invalidated through this stamp
+    op.execute("INSERT INTO change_stamp (name, value) VALUES ('search', 0)")
+
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        try:
+            op.execute("CREATE VIRTUAL TABLE package_search USING fts5(name, identifier, publisher, tokenize='trigram')")
+        except sa.exc.OperationalError:
+            # SQLite builds older than 3.34 lack the trigram tokenizer, app.search falls back to LIKE
+            return
+        op.execute(
+            'INSERT INTO package_search (rowid, name, identifier, publisher) '
+            'SELECT id, name, identifier, publisher FROM package'
+        )
+    elif bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for field in search_fields:
+            op.execute(f'CREATE INDEX IF NOT EXISTS ix_package_{field}_trgm ON package USING gin ({field} gin_trgm_ops)')
+
+
+def downgrade():
+    bind = op.get_bind()
+    op.execute("DELETE FROM change_stamp WHERE name = 'search'")
+    if bind.dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS package_search')
+    elif bind.dialect.name == 'postgresql':
+        for field in search_fields:
+            op.execute(f'DROP INDEX IF EXISTS ix_package_{field}_trgm')
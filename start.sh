@@ -1,9 +1,10 @@
 #!/bin/sh
-flask db upgrade
+# Upgrade the database only if it isn't at the newest migration already
+python check_migrations.py || flask db upgrade
 # Get log level from env variable
 if [ -z "$LOG_LEVEL" ]; then
     LOG_LEVEL=info
 fi
-# Start Gunicorn processes
+# Start Gunicorn processes, see gunicorn.conf.py
 echo Starting Gunicorn with $LOG_LEVEL log level
-exec gunicorn -b :8080 --workers 4 --worker-class gevent "app:create_app()" --log-level=$LOG_LEVEL
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py "app:create_app()" --log-level=$LOG_LEVEL